@@ -0,0 +1,45 @@
+"""books borrow counters
+
+Revision ID: 5d2a8e417f63
+Revises: c3e1d7a95b20
+Create Date: 2026-10-18 15:08:12.274690
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d2a8e417f63'
+down_revision = 'c3e1d7a95b20'
+branch_labels = None
+depends_on = None
+
+COUNTER_COLUMNS = ['borrow_count', 'recent_borrow_count', 'out_count']
+
+
+def upgrade() -> None:
+    for column in COUNTER_COLUMNS:
+        op.add_column('books', sa.Column(column, sa.Integer(), server_default='0', nullable=False))
+    # rentals only, sold books (status 4) are not borrows; open is TAKEN (0) or OVERDUE (2)
+    op.execute("""
+        UPDATE books SET
+            borrow_count = stats.total,
+            recent_borrow_count = stats.recent,
+            out_count = stats.out
+        FROM (
+            SELECT book,
+                   count(*) AS total,
+                   count(*) FILTER (WHERE taken_date >= now() - interval '30 days') AS recent,
+                   count(*) FILTER (WHERE status IN (0, 2)) AS out
+            FROM takenbooks
+            WHERE status != 4
+            GROUP BY book
+        ) AS stats
+        WHERE books.id = stats.book
+    """)
+
+
+def downgrade() -> None:
+    for column in reversed(COUNTER_COLUMNS):
+        op.drop_column('books', column)
@@ -0,0 +1,80 @@
+"""takenbooks dates as timestamptz
+
+Revision ID: 8fb1b9cc8736
+Revises: a472973ab238
+Create Date: 2026-10-18 11:02:17.840531
+
+"""
+import logging
+
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8fb1b9cc8736'
+down_revision = 'a472973ab238'
+branch_labels = None
+depends_on = None
+
+DATE_COLUMNS = ['taken_date', 'returning_date']
+# values the old code wrote that are not dates (e.g. the literal 'YYYY-MM-DDTHH:MM:SS'
+# of return_book) become NULL
+ISO_DATE = r'^\d{4}-\d{2}-\d{2}'
+
+logger = logging.getLogger('alembic.runtime.migration')
+
+
+def source_timezone() -> str:
+    # the old code stored str(datetime.now()), the app server's local time without
+    # an offset; pass its zone with `alembic -x source_tz=Asia/Tehran upgrade head`
+    return context.get_x_argument(as_dictionary=True).get('source_tz', 'UTC')
+
+
+def log_unconvertible_dates() -> None:
+    bind = op.get_bind()
+    for column in DATE_COLUMNS:
+        count = bind.scalar(
+            sa.text(
+                f"SELECT count(*) FROM takenbooks WHERE {column} !~ :pattern"
+            ).bindparams(pattern=ISO_DATE)
+        )
+        if count:
+            logger.warning(
+                "%s takenbooks.%s values are not dates and become NULL", count, column
+            )
+
+
+def upgrade() -> None:
+    # strings without an offset are read in the source time zone
+    source_tz = source_timezone()
+    logger.info("Reading takenbooks dates in time zone %s", source_tz)
+    op.execute(
+        sa.text("SELECT set_config('TimeZone', :tz, true)").bindparams(tz=source_tz)
+    )
+    if not context.is_offline_mode():
+        log_unconvertible_dates()
+    for column in DATE_COLUMNS:
+        op.alter_column(
+            'takenbooks', column,
+            existing_type=sa.String(),
+            type_=sa.DateTime(timezone=True),
+            existing_nullable=True,
+            postgresql_using=(
+                f"CASE WHEN {column} ~ '{ISO_DATE}' THEN {column}::timestamptz END"
+            ),
+        )
+    op.create_index('ix_takenbooks_book_taken_date', 'takenbooks', ['book', 'taken_date'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_takenbooks_book_taken_date', table_name='takenbooks')
+    op.execute("SET LOCAL TIME ZONE 'UTC'")
+    for column in DATE_COLUMNS:
+        op.alter_column(
+            'takenbooks', column,
+            existing_type=sa.DateTime(timezone=True),
+            type_=sa.String(),
+            existing_nullable=True,
+            postgresql_using=f"to_char({column}, 'YYYY-MM-DD\"T\"HH24:MI:SS.USOF')",
+        )
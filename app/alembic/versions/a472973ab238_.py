@@ -0,0 +1,85 @@
+"""book tables and takenbooks (status, user) index
+
+Revision ID: a472973ab238
+Revises: 6b05f5028e16
+Create Date: 2026-10-18 10:12:41.513208
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a472973ab238'
+down_revision = '6b05f5028e16'
+branch_labels = None
+depends_on = None
+
+# tables created here carry this comment, so downgrade drops only those
+CREATED_HERE = 'created by migration a472973ab238'
+BOOK_TABLES = ['takenbooks', 'books', 'categories']
+
+
+def upgrade() -> None:
+    # the book tables were never part of a migration, databases set up with
+    # `alembic upgrade head` alone don't have them yet
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table('categories'):
+        op.create_table('categories',
+        sa.Column('created', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('modified', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(), nullable=True),
+        sa.Column('limit', sa.Integer(), nullable=True),
+        sa.Column('rent_price', sa.Float(), nullable=True),
+        sa.Column('overdue_penalty', sa.Float(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        comment=CREATED_HERE,
+        )
+        for column in ['created', 'id', 'limit', 'modified', 'name', 'overdue_penalty', 'rent_price']:
+            op.create_index(op.f(f'ix_categories_{column}'), 'categories', [column], unique=False)
+    if not inspector.has_table('books'):
+        op.create_table('books',
+        sa.Column('created', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('modified', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(), nullable=True),
+        sa.Column('category', sa.Integer(), nullable=True),
+        sa.Column('amount', sa.Integer(), nullable=True),
+        sa.Column('serial_number', sa.String(), nullable=True),
+        sa.Column('sell_price', sa.Float(), nullable=True),
+        sa.ForeignKeyConstraint(['category'], ['categories.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        comment=CREATED_HERE,
+        )
+        for column in ['amount', 'created', 'id', 'modified', 'name', 'sell_price', 'serial_number']:
+            op.create_index(op.f(f'ix_books_{column}'), 'books', [column], unique=False)
+    if not inspector.has_table('takenbooks'):
+        op.create_table('takenbooks',
+        sa.Column('created', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('modified', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('book', sa.Integer(), nullable=True),
+        sa.Column('user', sa.Integer(), nullable=True),
+        sa.Column('taken_date', sa.String(), nullable=True),
+        sa.Column('returning_date', sa.String(), nullable=True),
+        sa.Column('valid_borrowed_days', sa.Integer(), nullable=True),
+        sa.Column('status', sa.Integer(), nullable=True),
+        sa.Column('bill', sa.Float(), nullable=True),
+        sa.ForeignKeyConstraint(['book'], ['books.id'], ),
+        sa.ForeignKeyConstraint(['user'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        comment=CREATED_HERE,
+        )
+        for column in ['bill', 'created', 'id', 'modified', 'returning_date', 'status', 'taken_date', 'valid_borrowed_days']:
+            op.create_index(op.f(f'ix_takenbooks_{column}'), 'takenbooks', [column], unique=False)
+    op.create_index('ix_takenbooks_status_user', 'takenbooks', ['status', 'user'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_takenbooks_status_user', table_name='takenbooks')
+    inspector = sa.inspect(op.get_bind())
+    # dependents first; their indexes go with them
+    for table in BOOK_TABLES:
+        if inspector.get_table_comment(table).get('text') == CREATED_HERE:
+            op.drop_table(table)
@@ -0,0 +1,28 @@
+"""partial index on open takenbooks
+
+Revision ID: c3e1d7a95b20
+Revises: 8fb1b9cc8736
+Create Date: 2026-10-18 14:26:41.503917
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3e1d7a95b20'
+down_revision = '8fb1b9cc8736'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # TAKEN (0) and OVERDUE (2) rentals
+    op.create_index(
+        'ix_takenbooks_open_user_book', 'takenbooks', ['user', 'book'], unique=False,
+        postgresql_where=sa.text('status IN (0, 2)'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_takenbooks_open_user_book', table_name='takenbooks')
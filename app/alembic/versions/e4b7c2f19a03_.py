@@ -0,0 +1,24 @@
+"""takenbooks last billed day
+
+Revision ID: e4b7c2f19a03
+Revises: 5d2a8e417f63
+Create Date: 2026-10-18 17:42:05.118302
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4b7c2f19a03'
+down_revision = '5d2a8e417f63'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('takenbooks', sa.Column('last_billed', sa.Date(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('takenbooks', 'last_billed')
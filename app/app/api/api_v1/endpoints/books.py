@@ -1,10 +1,10 @@
-# TODO Since we have only one library manager we don't need semaphore and lock conditions but
-#  In case of having multiple supervisors/managers we have to add lock acquire before selling/renting a book
+# Selling and renting take stock and debit balances with conditional UPDATEs
+#  (crud.book.change_stock, crud.user.change_balance), so no lock is needed
 
 import datetime
 from datetime import timedelta
 
-from fastapi import APIRouter, Body, Depends
+from fastapi import APIRouter, Body, Depends, Query
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import HTTPException
@@ -23,8 +23,9 @@ from app.api.api_v1 import service
 from app.core import security, library_management
 from app.core.config import settings
 from app.core.security import get_password_hash
-from app.utils import APIResponseType, APIResponse
+from app.utils import APIResponseType, APIResponse, APIStreamingResponse
 from app import exceptions as exc
+from app.log.log import LogRoute
 from app.utils.user import (
     verify_password_reset_token,
 )
@@ -33,16 +34,17 @@ from cache.util import ONE_DAY_IN_SECONDS
 
 from dateutil import tz
 
-router = APIRouter()
+router = APIRouter(route_class=LogRoute)
 namespace = "book"
 
 @router.get('/get-all')
 async def get_all_books(
         request: Request,
         db: AsyncSession = Depends(deps.get_db_async),
+        ndjson: bool = False,
     ):
-    books = await crud.book.get_all(db)
-    return APIResponse(books)
+    # the session stays open until the response is sent
+    return APIStreamingResponse(crud.book.stream(db), ndjson=ndjson)
 
 @router.post('/create')
 async def create_book(*, db: AsyncSession = Depends(deps.get_db_async), book_in: schemas.Book):
@@ -62,19 +64,38 @@ async def update(*, db: AsyncSession = Depends(deps.get_db_async),
     updated_book = await crud.book.update(db, db_obj=current_book, obj_in=book)
     return APIResponse(updated_book)
 
+@router.post('/bulk-create')
+async def bulk_create_books(*, db: AsyncSession = Depends(deps.get_db_async),
+                            books_in: list[schemas.Book], copy: bool = False):
+    # copy: load with COPY, faster for very large batches but only returns the count
+    if copy:
+        columns = schemas.Book.__fields__.keys()
+        count = await crud.book.copy_many(db, objs_in=books_in, columns=columns)
+        return APIResponse(count)
+    return APIResponse(await crud.book.create_many(db, objs_in=books_in))
+
+@router.put('/bulk-update')
+async def bulk_update_books(*, db: AsyncSession = Depends(deps.get_db_async),
+                            books_in: list[schemas.BookUpdate]):
+    return APIResponse(await crud.book.update_many(db, objs_in=books_in))
+
+@router.put('/bulk-upsert')
+async def bulk_upsert_books(*, db: AsyncSession = Depends(deps.get_db_async),
+                            books_in: list[schemas.BookUpsert]):
+    return APIResponse(await crud.book.upsert_many(db, objs_in=books_in))
+
 @router.get('/taken-books/get-all')
 async def get_all_taken_books(
         request: Request,
         db: AsyncSession = Depends(deps.get_db_async),
+        ndjson: bool = False,
     ):
-    books = await crud.taken_book.get_all(db)
-    return APIResponse(books)
+    return APIStreamingResponse(crud.taken_book.stream(db), ndjson=ndjson)
 
 @router.post('/taken-books/create')
 async def create_taken_book(*, db: AsyncSession = Depends(deps.get_db_async), book_in: schemas.TakenBook):
     user = await crud.user.get_by_id(db, book_in.user)
-    tbs = await crud.taken_book.get_by_user(db, user.id)
-    return APIResponse(await service.rent_book(db, user, tbs, book_in))
+    return APIResponse(await service.rent_book(db, user, book_in))
 
 
 @router.post('/taken-books/return-book')
@@ -101,9 +122,9 @@ async def update_taken_book(*, db:AsyncSession=Depends(deps.get_db_async),
 async def get_all_categories(
         request: Request,
         db: AsyncSession = Depends(deps.get_db_async),
+        ndjson: bool = False,
     ):
-    categories = await crud.category.get_all(db)
-    return APIResponse(categories)
+    return APIStreamingResponse(crud.category.stream(db), ndjson=ndjson)
 
 @router.post('/categories/create')
 async def create_category(*, db: AsyncSession = Depends(deps.get_db_async), book_in: schemas.Category):
@@ -125,6 +146,31 @@ async def update_category(*, db: AsyncSession = Depends(deps.get_db_async),
     return APIResponse(updated_category)
 
 
+@router.post('/categories/bulk-create')
+async def bulk_create_categories(*, db: AsyncSession = Depends(deps.get_db_async),
+                                 categories_in: list[schemas.Category],
+                                 copy: bool = False):
+    if copy:
+        columns = schemas.Category.__fields__.keys()
+        count = await crud.category.copy_many(
+            db, objs_in=categories_in, columns=columns
+        )
+        return APIResponse(count)
+    return APIResponse(await crud.category.create_many(db, objs_in=categories_in))
+
+
+@router.put('/categories/bulk-update')
+async def bulk_update_categories(*, db: AsyncSession = Depends(deps.get_db_async),
+                                 categories_in: list[schemas.CategoryUpdate]):
+    return APIResponse(await crud.category.update_many(db, objs_in=categories_in))
+
+
+@router.put('/categories/bulk-upsert')
+async def bulk_upsert_categories(*, db: AsyncSession = Depends(deps.get_db_async),
+                                 categories_in: list[schemas.CategoryUpsert]):
+    return APIResponse(await crud.category.upsert_many(db, objs_in=categories_in))
+
+
 @router.get('/get-user-taken-books/{user_id}')
 async def get_user_tbs(*, db: AsyncSession = Depends(deps.get_db_async), user_id: int,
                        name: str = None, category_id: int = None, borrowed_times: int = None, amount: int = None):
@@ -149,48 +195,47 @@ async def sell_book(*, db: AsyncSession = Depends(deps.get_db_async), book_id: i
 
 @router.get('/statistics')
 async def get_statistics(*, db: AsyncSession = Depends(deps.get_db_async)):
-    tbs = await crud.taken_book.get_all(db)
+    statistics = await crud.taken_book.get_statistics(db)
     cats = await crud.category.get_all(db)
     cats_profit = {}
     for c in cats:
         cats_profit[str(c.id)] = 0
-    sells = []
+    sells = rents = in_rents = 0
     sells_overall_gain = 0
     rents_overall_gain = 0
-    rents = []
-    in_rents = []
-    for tb in tbs:
-        book = await crud.book.get_by_id(db, tb.book)
-        if book:
-            cats_profit[str(book.category)] += tb.bill
-        if tb.status == schemas.book.TakenBookStatus().SOLD:
-            sells.append(tb)
-            sells_overall_gain += tb.bill
-        elif tb.status == schemas.book.TakenBookStatus().RECEIVED \
-                or tb.status == schemas.book.TakenBookStatus().OVERDUE_DELIVERED:
-            rents.append(tb)
-            rents_overall_gain += tb.bill
+    for category_id, status, count, bill in statistics:
+        if category_id is not None:
+            cats_profit[str(category_id)] += bill
+        if status == schemas.book.TakenBookStatus().SOLD:
+            sells += count
+            sells_overall_gain += bill
+        elif status == schemas.book.TakenBookStatus().RECEIVED \
+                or status == schemas.book.TakenBookStatus().OVERDUE_DELIVERED:
+            rents += count
+            rents_overall_gain += bill
         else:
-            in_rents.append(tb)
+            in_rents += count
     return {"msg": "Statistics Calculated",
-            "sell": f"Sold {len(sells)} books | Gain: {sells_overall_gain}$",
-            "rent": f"Loaned {len(rents)} books | Gain: {rents_overall_gain}$ & {len(in_rents)} books have been rented but not delivered yet ",
+            "sell": f"Sold {sells} books | Gain: {sells_overall_gain}$",
+            "rent": f"Loaned {rents} books | Gain: {rents_overall_gain}$ & "
+                    f"{in_rents} books have been rented but not delivered yet ",
             "category_classified": cats_profit}
 
 
 @router.get('/find-users-violations')
-async def get_user_violations(*, db: AsyncSession = Depends(deps.get_db_async), ascending: bool = True):
-    tbs = await crud.taken_book.get_all(db)
-    violations = {}
-    for tb in tbs:
-        user = await crud.user.get_by_id(db, tb.user)
-        if tb.status == schemas.book.TakenBookStatus().OVERDUE or \
-                tb.status == schemas.book.TakenBookStatus().OVERDUE_DELIVERED:
-            try:
-                violations[str(user.id)] = (user.email, violations[str(user.id)][1] + 1)
-            except KeyError as e:
-                violations[str(user.id)] = (user.email, 1)
-
-    return APIResponse(sorted(violations.items(), key= lambda x:x[1][1], reverse=ascending))
+async def get_user_violations(
+    *,
+    db: AsyncSession = Depends(deps.get_db_async),
+    ascending: bool = True,
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+):
+    # ascending=True has always listed the most violations first
+    violations = await crud.taken_book.get_violations(
+        db, most_first=ascending, limit=limit, offset=offset
+    )
+    return APIResponse(
+        [(str(user_id), (email, count)) for user_id, email, count in violations]
+    )
 
 
@@ -1,7 +1,7 @@
 from datetime import datetime
 from typing import Any
 
-from fastapi import APIRouter, Body, Depends
+from fastapi import APIRouter, Body, Depends, Query
 from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import HTTPException
 from starlette import status
@@ -15,19 +15,33 @@ from app.api import deps
 from app.core import security
 from app.core.config import settings
 from app.core.security import get_password_hash
-from app.utils import APIResponseType, APIResponse
+from app.crud.base import InvalidCursor
+from app.utils import APIResponseType, APIResponse, CursorContent
 from app import exceptions as exc
+from app.log.log import LogRoute
 from app.utils.user import (
     verify_password_reset_token,
 )
-from cache import cache, invalidate
-from cache.util import ONE_DAY_IN_SECONDS
+from cache import CacheRoute, cache, invalidate
+from cache.util import ONE_DAY_IN_SECONDS, ONE_HOUR_IN_SECONDS
 
 
-router = APIRouter()
+class CacheLogRoute(LogRoute, CacheRoute):
+    """Answers `@cache` hits early and logs every request, cached or not."""
+
+
+router = APIRouter(route_class=CacheLogRoute)
 namespace = "user"
 
 
+def user_tags(response: dict) -> list[str]:
+    """Tags of the users listed in an `APIResponse`."""
+    users = response["content"]
+    if isinstance(users, CursorContent):
+        users = users.data
+    return [f"user:{user.id}" for user in users]
+
+
 @router.post("/token")
 async def login(
     login_user_in: schemas.LoginUser,
@@ -144,22 +158,53 @@ async def reset_password(
 
 
 @router.get("/")
-@cache(namespace=namespace, expire=ONE_DAY_IN_SECONDS)
+@cache(
+    namespace=namespace,
+    expire=ONE_DAY_IN_SECONDS,
+    stale_ttl=ONE_HOUR_IN_SECONDS,
+    early_refresh=1,
+    vary_claims=["sub"],
+    tags=["user-list", user_tags],
+)
 async def read_users(
     db: AsyncSession = Depends(deps.get_db_async),
     skip: int = 0,
-    limit: int = 100,
+    limit: int = Query(100, ge=1, le=1000),
+    after: str | None = None,
+    before: str | None = None,
     current_user: models.User = Depends(deps.get_current_active_superuser),
-) -> APIResponseType[list[schemas.User]]:
+) -> APIResponseType[list[schemas.User] | CursorContent[list[schemas.User]]]:
     """
-    Retrieve users.
+    Retrieve users, newest first.
+
+    Pages are read with `skip` by default and the content is the list of
+    users. For cursor pagination pass `after` (empty for the first page, then
+    `next_cursor`) or `before` with `prev_cursor`; the content then holds the
+    users and the cursors, and deep pages cost the same as the first one.
     """
-    users = await crud.user.get_multi(db, skip=skip, limit=limit)
-    return APIResponse(users)
+    if after is None and before is None:
+        users = await crud.user.get_multi(db, skip=skip, limit=limit)
+        return APIResponse(users)
+    try:
+        page = await crud.user.get_page(db, limit=limit, after=after, before=before)
+    except InvalidCursor:
+        raise exc.InternalServiceError(
+            status_code=400,
+            detail="Invalid pagination cursor.",
+            msg_code=utils.MessageCodes.bad_request,
+        )
+    return APIResponse(
+        CursorContent(
+            data=page.items,
+            limit=limit,
+            next_cursor=page.next_cursor,
+            prev_cursor=page.prev_cursor,
+        )
+    )
 
 
 @router.post("/")
-@invalidate(namespace=namespace)
+@invalidate(tags=["user-list"])
 async def create_user(
     *,
     db: AsyncSession = Depends(deps.get_db_async),
@@ -181,7 +226,7 @@ async def create_user(
 
 
 @router.put("/update/me")
-@invalidate(namespace=namespace)
+@invalidate(tags=["user:{current_user.id}"], claims={"sub": "{current_user.id}"})
 async def update_user_me(
     *,
     db: AsyncSession = Depends(deps.get_db_async),
@@ -206,7 +251,12 @@ async def update_user_me(
 
 
 @router.get("/{user_id}")
-@cache(namespace=namespace, expire=ONE_DAY_IN_SECONDS)
+@cache(
+    namespace=namespace,
+    expire=ONE_DAY_IN_SECONDS,
+    vary_claims=["sub"],
+    tags=["user:{user_id}"],
+)
 async def read_user_by_id(
     user_id: int,
     current_user: models.User = Depends(deps.get_current_active_user),
@@ -234,6 +284,8 @@ async def read_user_by_id(
 
 
 @router.put("/{user_id}")
+# hits keyed by the user's `sub` skip the active/superuser checks
+@invalidate(tags=["user:{user_id}"], claims={"sub": "{user_id}"})
 async def update_user(
     *,
     db: AsyncSession = Depends(deps.get_db_async),
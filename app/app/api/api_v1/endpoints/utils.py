@@ -6,10 +6,11 @@ from celery.result import AsyncResult
 from app import models, schemas
 from app.api import deps
 from app.core.celery_app import celery_app
+from app.log.log import LogRoute
 from cache import Cache
 
 
-router = APIRouter()
+router = APIRouter(route_class=LogRoute)
 
 
 @router.post("/test-celery/", response_model=schemas.Msg, status_code=201)
@@ -41,6 +42,16 @@ async def test_redis(
         return {"msg": f"ERROR: {str(e)}"}
 
 
+@router.get("/cache-stats/")
+async def cache_stats(
+    current_user: models.User = Depends(deps.get_current_active_superuser),
+) -> Any:
+    """
+    Cache counters of the worker serving the request.
+    """
+    return Cache().stats.as_dict()
+
+
 @router.websocket("/echo-client/")
 async def echo_client(websocket: WebSocket):
     await websocket.accept()
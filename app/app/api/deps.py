@@ -1,7 +1,7 @@
 from datetime import datetime
 from typing import Generator, AsyncGenerator
 
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 # from fastapi.security import OAuth2PasswordBearer
 from fastapi.security import HTTPBearer
 from pydantic import ValidationError
@@ -28,6 +28,20 @@ async def get_db_async() -> AsyncGenerator:
         yield session
 
 
+def get_token_claims(request: Request) -> dict | None:
+    """
+    Verified claims of the bearer token of the request, None if it has no valid one.
+    Used by the route-level cache to key responses before dependencies run.
+    """
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        return jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+    except jwt.PyJWTError:
+        return None
+
+
 async def get_current_user(
     authorization: str = Depends(HTTPBearer()),
     db: Session | AsyncSession = Depends(get_db_async)
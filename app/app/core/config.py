@@ -37,6 +37,32 @@ class Settings(BaseSettings):
     REDIS_PORT: int
     REDIS_PASSWORD: str
     REDIS_TIMEOUT: Optional[int] = 5
+    # "redis", or "memory" to keep the cache in each worker without redis
+    CACHE_BACKEND: str = "redis"
+    # per-worker in-process cache in front of redis, 0 disables it
+    CACHE_LOCAL_MAX_ITEMS: int = 10_000
+    CACHE_LOCAL_MAX_BYTES: int = 64 * 1024 * 1024
+    CACHE_LOCAL_TTL: int = 60
+    # format of new cache entries (json, orjson, msgpack) and optional zstd/lz4
+    CACHE_CODEC: str = "json"
+    CACHE_COMPRESSION: Optional[str] = None
+    CACHE_COMPRESSION_MIN_SIZE: int = 1024
+
+    # request logs are queued in each worker and written in batches
+    REQUEST_LOG_BATCH_SIZE: int = 500
+    REQUEST_LOG_FLUSH_INTERVAL: float = 2.0
+    REQUEST_LOG_QUEUE_SIZE: int = 10_000
+    # when the queue is full: "drop" the log, or "block" the background task
+    REQUEST_LOG_OVERFLOW: str = "drop"
+    # JSON lists of glob patterns on the request path, e.g. ["*/get-all"];
+    # without includes every route is logged
+    REQUEST_LOG_INCLUDE_ROUTES: List[str] = []
+    REQUEST_LOG_EXCLUDE_ROUTES: List[str] = []
+    # share of successful requests logged, errors (status >= 400) always are
+    REQUEST_LOG_SAMPLE_RATE: float = 1.0
+    # request and response bodies are cut to this many bytes, 0 keeps none
+    REQUEST_LOG_MAX_BODY_BYTES: int = 4096
+    REQUEST_LOG_REDACT_AUTHORIZATION: bool = True
 
     BACKEND_CORS_ORIGINS: List[AnyHttpUrl] = []
     authjwt_secret_key: str = "secret"
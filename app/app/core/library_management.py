@@ -1,14 +1,29 @@
 import datetime
-from dateutil import parser
+import logging
+import time
+from dataclasses import dataclass
 
 from app import crud, models, schemas, utils, api
 from sqlalchemy.orm import Session
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from fastapi.encoders import jsonable_encoder
+BILLING_CHUNK_SIZE = 10_000
+COUNTERS_CHUNK_SIZE = 10_000
+RECENT_BORROW_DAYS = 30
 
+logger = logging.getLogger(__name__)
 
-async def find_valid_rent_days(db: Session | AsyncSession, book: schemas.Book):
+
+@dataclass
+class BillingProgress:
+    chunks: int = 0
+    rentals: int = 0
+    overdue: int = 0
+    charged: float = 0.0
+    elapsed: float = 0.0
+
+
+async def find_valid_rent_days(db: Session | AsyncSession, book: models.book.Book):
     n = book.amount
     if n == 0:
         return 0
@@ -18,59 +33,82 @@ async def find_valid_rent_days(db: Session | AsyncSession, book: schemas.Book):
         return 3
     return result
 
-async def find_borrowed_times(db: Session | AsyncSession, book: schemas.Book):
-    tbs = await crud.taken_book.get_by_book(db, book.id)
-    last_30 = []
-    for tb in tbs:
-        now = datetime.datetime.now()
-        try:
-            taken_date = parser.parse(tb.taken_date)
-            taken_date = taken_date.replace(tzinfo=None)
-            diff = now - taken_date
-            days_30 = datetime.timedelta(days=30)
-            if diff > days_30:
-                last_30.append(tb)
-        except Exception as e:
-            print(e)
-            continue
-    return len(last_30)
+async def find_borrowed_times(db: Session | AsyncSession, book: models.book.Book):
+    # times the book was rented in the last 30 days, a counter kept on the book
+    return book.recent_borrow_count
 
 async def can_borrow_from_cat(db: Session | AsyncSession, book: schemas.Book, user: schemas.User):
-    category = await crud.category.get_by_id(db, book.category)
-    user_taken_books = await crud.taken_book.get_by_user(db, user.id)
-    tb_cnt = 0
-    for tb in user_taken_books:
-        if tb.status == schemas.book.TakenBookStatus().TAKEN or tb.status == schemas.book.TakenBookStatus().OVERDUE:
-            _book = await crud.book.get_by_id(db, tb.book)
-            if _book.category == book.category:
-                tb_cnt += 1
+    category = await crud.category.load(db, book.category)
+    tb_cnt = await crud.taken_book.count_open_in_category(db, user.id, book.category)
     if tb_cnt >= category.limit:
         return False
     return True
 
-async def add_bill_to_tbs(db: Session | AsyncSession, tbs: [models.book.TakenBook]):
-    for tb in tbs:
-        try:
-            if not tb.book or not tb.user:
-                print(f"Error: Taken Book Data has been saved incorrectly update it asap. ID: {tb.id}")
-                crud.taken_book.delete()
-                continue
-            user = crud.user.get_by_id(db, tb.user)
-            book = crud.book.get_by_id(db, tb.book)
-            category = crud.category.get_by_id(db, book.category)
-            current_user_data = jsonable_encoder(user)
-            user_in = schemas.UserUpdate(**current_user_data)
-            user_in.balance -= category.rent_price
-            crud.user.update(db, db_obj=user, obj_in=user_in)
-            taken_date = parser.parse(tb.taken_date)
-            _td = schemas.TakenBook.from_db(db_obj=tb)
-            _td.bill += category.rent_price
-            if taken_date.replace(tzinfo=None) < datetime.datetime.now():
-                _td.status = schemas.book.TakenBookStatus().OVERDUE
-            crud.taken_book.update(db, db_obj=tb, obj_in=_td)
-            print(f"Applied Bill[{tb.id}] Belonging to {user.email} by amount of {category.rent_price}")
-        except TypeError as e:
-            print(e)
-            print(f"Error: Taken Book Data has been saved incorrectly update it asap. ID: {tb.id}")
-            continue
+async def bill_taken_books(
+    db: AsyncSession, *, chunk_size: int = BILLING_CHUNK_SIZE
+) -> BillingProgress:
+    """
+    Daily billing: charge one day of rent for every taken book that is not
+    returned yet and flag the overdue ones.
 
+    The taken books are processed in chunks of `chunk_size` ids, paged by
+    keyset (see `crud.taken_book.get_billing_chunk_end`), each billed by
+    `crud.taken_book.bill_open_rentals` and committed on its own so row locks
+    are held for one chunk only. A taken book is billed at most once a day,
+    so a run that failed halfway can simply be started again. Progress is
+    logged after every chunk.
+    """
+    progress = BillingProgress()
+    now = datetime.datetime.now(datetime.timezone.utc)
+    started = time.perf_counter()
+    chunk_start = 0
+    while True:
+        chunk_end = await crud.taken_book.get_billing_chunk_end(
+            db, after_id=chunk_start, size=chunk_size, today=now.date()
+        )
+        if chunk_end is None:
+            break
+        rentals, overdue, charged = await crud.taken_book.bill_open_rentals(
+            db, first_id=chunk_start + 1, last_id=chunk_end, now=now
+        )
+        await db.commit()
+        chunk_start = chunk_end
+        progress.chunks += 1
+        progress.rentals += rentals
+        progress.overdue += overdue
+        progress.charged += charged
+        progress.elapsed = time.perf_counter() - started
+        logger.info(
+            "Billing: ids up to %s, %s taken books (%s overdue) billed %.2f in %.1fs",
+            chunk_end,
+            progress.rentals,
+            progress.overdue,
+            progress.charged,
+            progress.elapsed,
+        )
+    return progress
+
+
+async def recompute_book_counters(
+    db: AsyncSession, *, chunk_size: int = COUNTERS_CHUNK_SIZE
+) -> int:
+    """
+    Nightly: recount the borrow counters of every book from the taken books,
+    in id ranges of `chunk_size` committed on their own. Ages out the
+    rentals older than `RECENT_BORROW_DAYS` and fixes any drift. Returns how
+    many books were corrected.
+    """
+    first_id, last_id = await crud.book.get_id_range(db)
+    if first_id is None:
+        return 0
+    now = datetime.datetime.now(datetime.timezone.utc)
+    since = now - datetime.timedelta(days=RECENT_BORROW_DAYS)
+    corrected = 0
+    for chunk_start in range(first_id, last_id + 1, chunk_size):
+        chunk_end = min(chunk_start + chunk_size - 1, last_id)
+        corrected += await crud.book.recompute_borrow_counters(
+            db, first_id=chunk_start, last_id=chunk_end, since=since
+        )
+        await db.commit()
+    logger.info("Book counters: %s books corrected", corrected)
+    return corrected
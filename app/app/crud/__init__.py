@@ -1,3 +1,4 @@
+from .base import unit_of_work
 from .crud_user import user
 from .crud_book import book, taken_book, category
 from .crud_request_log import request_log
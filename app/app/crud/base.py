@@ -1,21 +1,166 @@
+import asyncio
+import binascii
+import json
 from asyncio import iscoroutine
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
 from datetime import datetime
-from typing import Awaitable, Any, Generic, Type, TypeVar
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    Any,
+    Generic,
+    Iterable,
+    Sequence,
+    Type,
+    TypeVar,
+)
 
 from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel
+from sqlalchemy import any_, bindparam, cast, func, tuple_, update
+from sqlalchemy.dialects.postgresql import ARRAY, REGCLASS
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import Session
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.future import select
+from sqlalchemy.future import Select, select
+from sqlalchemy.sql.dml import Update
 
 from app.db.base_class import Base
 
 
+STREAM_BATCH_SIZE = 1000
+LOADERS_KEY = "batch_loaders"
+UNIT_OF_WORK_KEY = "unit_of_work"
+# asyncpg accepts at most 32767 parameters per statement
+MAX_PARAMS = 32767
+BULK_BATCH_SIZE = 1000
+
 ModelType = TypeVar("ModelType", bound=Base)
 CreateSchemaType = TypeVar("CreateSchemaType", bound=BaseModel)
 UpdateSchemaType = TypeVar("UpdateSchemaType", bound=BaseModel)
 
 
+class InvalidCursor(ValueError):
+    """The pagination cursor was not created by `get_page` for this ordering"""
+
+
+@dataclass
+class CursorPage(Generic[ModelType]):
+    """One page of `get_page` and the cursors of its neighbouring pages"""
+
+    items: list[ModelType]
+    next_cursor: str | None = None
+    prev_cursor: str | None = None
+
+
+@asynccontextmanager
+async def unit_of_work(db: AsyncSession) -> AsyncIterator[AsyncSession]:
+    """
+    Commit everything the CRUD methods do inside the block once at the end.
+
+    Inside the block `create`, `update` and `remove` only flush: the primary
+    keys come back from the `INSERT ... RETURNING` of the flush and the other
+    defaults are set in Python, so there is no refresh `SELECT` either. An
+    exception rolls the whole block back. Nested blocks join the outer one.
+    """
+    if db.info.get(UNIT_OF_WORK_KEY):
+        yield db
+        return
+    db.info[UNIT_OF_WORK_KEY] = True
+    try:
+        yield db
+        await db.commit()
+    except BaseException:
+        await db.rollback()
+        raise
+    finally:
+        del db.info[UNIT_OF_WORK_KEY]
+
+
+class BatchLoader(Generic[ModelType]):
+    """
+    Collects the ids requested with `load` until one of them is awaited, then
+    fetches them all with a single `WHERE id = ANY(:ids)` query while that
+    caller waits, so the session is never used behind the caller's back.
+    Results are kept for the life of the session, which `get_db_async` opens
+    per request. Get it with `CRUDBase.loader`.
+    """
+
+    def __init__(self, crud: "CRUDBase", db: AsyncSession):
+        self.crud = crud
+        self.db = db
+        self.results: dict[Any, asyncio.Future] = {}
+        self.pending: list[Any] = []
+        # concurrent awaits share the session, one of them queries at a time
+        self.lock = asyncio.Lock()
+
+    def load(self, id: Any) -> Awaitable[ModelType | None]:
+        result = self.results.get(id)
+        if result is None:
+            result = self.results[id] = asyncio.get_running_loop().create_future()
+            self.pending.append(id)
+        return self._resolve(result)
+
+    async def load_many(self, ids: Sequence[Any]) -> list[ModelType | None]:
+        # every id is requested before the first await dispatches them
+        results = [self.load(id) for id in ids]
+        return [await result for result in results]
+
+    async def _resolve(self, result: asyncio.Future) -> ModelType | None:
+        if not result.done():
+            async with self.lock:
+                if not result.done():
+                    await self.dispatch()
+        return await result
+
+    async def dispatch(self) -> None:
+        ids, self.pending = self.pending, []
+        try:
+            rows = await self.crud.get_by_ids(self.db, ids)
+        except asyncio.CancelledError:
+            # the caller went away, the next awaited load fetches them
+            self.pending[:0] = ids
+            raise
+        except Exception as e:
+            for id in ids:
+                # not memoized, a later load retries
+                result = self.results.pop(id)
+                if not result.done():
+                    result.set_exception(e)
+            return
+        found = {row.id: row for row in rows}
+        for id in ids:
+            result = self.results[id]
+            if not result.done():
+                result.set_result(found.get(id))
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    data = json.dumps(jsonable_encoder(values), separators=(",", ":"))
+    return urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, columns: Sequence[Any]) -> list[Any]:
+    try:
+        data = urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(data)
+    except (binascii.Error, ValueError) as e:
+        raise InvalidCursor(cursor) from e
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise InvalidCursor(cursor)
+    try:
+        return [
+            datetime.fromisoformat(value)
+            if column.type.python_type is datetime
+            else column.type.python_type(value)
+            for column, value in zip(columns, values)
+        ]
+    except (TypeError, ValueError) as e:
+        raise InvalidCursor(cursor) from e
+
+
 class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
     def __init__(self, model: Type[ModelType]):
         """
@@ -31,6 +176,9 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
     async def _commit_refresh_async(
         self, db: AsyncSession, db_obj: ModelType
     ) -> ModelType:
+        if db.info.get(UNIT_OF_WORK_KEY):
+            await db.flush()
+            return db_obj
         await db.commit()
         await db.refresh(db_obj)
         return db_obj
@@ -77,6 +225,42 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
         query = select(self.model).filter(self.model.id == id)
         return self._first(db.scalars(query))
 
+    def get_by_ids(
+        self, db: Session | AsyncSession, ids: Sequence[Any]
+    ) -> list[ModelType] | Awaitable[list[ModelType]]:
+        """
+        All rows with one of `ids` in one query, in no particular order.
+        The ids are sent as one array parameter, so every call shares the same
+        prepared statement however many ids it asks for.
+        """
+        ids = bindparam("ids", list(ids), type_=ARRAY(self.model.id.type))
+        query = select(self.model).filter(self.model.id == any_(ids))
+        return self._all(db.scalars(query))
+
+    def loader(self, db: AsyncSession) -> BatchLoader[ModelType]:
+        """
+        The `BatchLoader` of this model for the session `db`.
+        """
+        loaders = db.info.setdefault(LOADERS_KEY, {})
+        if self.model not in loaders:
+            loaders[self.model] = BatchLoader(self, db)
+        return loaders[self.model]
+
+    def load(self, db: AsyncSession, id: Any) -> Awaitable[ModelType | None]:
+        """
+        Like `get`, but batched with the other `load` calls made before it is
+        awaited and memoized for the rest of the request.
+        """
+        return self.loader(db).load(id)
+
+    def load_many(
+        self, db: AsyncSession, ids: Sequence[Any]
+    ) -> Awaitable[list[ModelType | None]]:
+        """
+        Rows of `ids` in the same order (None for missing ones), see `load`.
+        """
+        return self.loader(db).load_many(ids)
+
     def get_multi(
         self,
         db: Session | AsyncSession,
@@ -94,6 +278,122 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
             return self._all(db.scalars(query))
         return self._all(db.scalars(query.limit(limit)))
 
+    async def stream(
+        self,
+        db: AsyncSession,
+        query: Select | None = None,
+        *,
+        batch_size: int = STREAM_BATCH_SIZE
+    ) -> AsyncIterator[list[ModelType]]:
+        """
+        Yield the rows of `query` (all rows by id by default) in batches.
+
+        Rows are read through a server-side cursor `batch_size` at a time, so
+        memory does not grow with the table. The session must stay open until
+        the iteration ends.
+        """
+        if query is None:
+            query = select(self.model).order_by(self.model.id)
+        result = await db.stream_scalars(
+            query.execution_options(yield_per=batch_size)
+        )
+        async for batch in result.partitions():
+            yield batch
+
+    def get_page(
+        self,
+        db: Session | AsyncSession,
+        *,
+        limit: int = 100,
+        after: str | None = None,
+        before: str | None = None,
+        asc: bool = False,
+        order_by: Sequence[str] = ("id",)
+    ) -> CursorPage[ModelType] | Awaitable[CursorPage[ModelType]]:
+        """
+        Keyset pagination over `order_by`, which must end with a unique column.
+
+        Pass `next_cursor` of a page as `after` to get the following page and
+        `prev_cursor` as `before` to go back. The cursor seeks to its row
+        through the index instead of skipping rows like `offset` does, so every
+        page costs the same however deep it is.
+        """
+        if after and before:
+            raise InvalidCursor("pass either after or before")
+        columns = [getattr(self.model, name) for name in order_by]
+        backwards = before is not None
+        # a previous page is read in reverse order starting next to the cursor
+        ascending = asc != backwards
+        query = (
+            select(self.model)
+            .order_by(
+                *(column.asc() if ascending else column.desc() for column in columns)
+            )
+            .limit(limit + 1)
+        )
+        cursor = after or before
+        if cursor:
+            key = tuple_(*columns)
+            values = tuple_(*decode_cursor(cursor, columns))
+            query = query.filter(key > values if ascending else key < values)
+        scalars = db.scalars(query)
+        if iscoroutine(scalars):
+            return self._page_async(scalars, limit, order_by, bool(cursor), backwards)
+        return self._page(scalars.all(), limit, order_by, bool(cursor), backwards)
+
+    async def _page_async(
+        self,
+        scalars,
+        limit: int,
+        order_by: Sequence[str],
+        has_cursor: bool,
+        backwards: bool,
+    ) -> CursorPage[ModelType]:
+        results = await scalars
+        return self._page(results.all(), limit, order_by, has_cursor, backwards)
+
+    def _page(
+        self,
+        rows: list[ModelType],
+        limit: int,
+        order_by: Sequence[str],
+        has_cursor: bool,
+        backwards: bool,
+    ) -> CursorPage[ModelType]:
+        has_more = len(rows) > limit
+        items = list(rows[:limit])
+        if backwards:
+            items.reverse()
+        page = CursorPage(items)
+        if not items:
+            return page
+        if backwards:
+            has_next, has_prev = has_cursor, has_more
+        else:
+            has_next, has_prev = has_more, has_cursor
+        if has_next:
+            page.next_cursor = self.get_cursor(items[-1], order_by)
+        if has_prev:
+            page.prev_cursor = self.get_cursor(items[0], order_by)
+        return page
+
+    def get_cursor(self, db_obj: ModelType, order_by: Sequence[str] = ("id",)) -> str:
+        return encode_cursor([getattr(db_obj, name) for name in order_by])
+
+    def _update_returning(
+        self, db: Session | AsyncSession, statement: Update
+    ) -> ModelType | None | Awaitable[ModelType | None]:
+        """
+        Run an `UPDATE` on a single row without committing and return the row
+        from its `RETURNING` clause, None if no row matched.
+        """
+        query = (
+            select(self.model)
+            .from_statement(statement.returning(*self.model.__table__.columns))
+            .execution_options(populate_existing=True)
+        )
+        return self._first(db.scalars(query))
+
     def create(
         self, db: Session | AsyncSession, *, obj_in: CreateSchemaType
     ) -> ModelType | Awaitable[ModelType]:
@@ -102,6 +402,177 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
         db.add(db_obj)
         return self._commit_refresh(db=db, db_obj=db_obj)
 
+    async def create_many(
+        self,
+        db: AsyncSession,
+        *,
+        objs_in: Sequence[CreateSchemaType | dict[str, Any]],
+        batch_size: int = BULK_BATCH_SIZE
+    ) -> list[ModelType]:
+        """
+        Insert all rows with multi-row `INSERT ... RETURNING` statements of
+        up to `batch_size` rows and commit once (or flush in `unit_of_work`).
+        Every row must set the same fields.
+        """
+        return await self._insert_many(db, self._rows(objs_in), batch_size)
+
+    async def upsert_many(
+        self,
+        db: AsyncSession,
+        *,
+        objs_in: Sequence[CreateSchemaType | dict[str, Any]],
+        index_elements: Sequence[str] = ("id",),
+        batch_size: int = BULK_BATCH_SIZE
+    ) -> list[ModelType]:
+        """
+        Like `create_many`, but rows that conflict on `index_elements` (a
+        unique column set) update their other fields instead, with
+        `INSERT ... ON CONFLICT DO UPDATE`. When rows bring their own ids the
+        id sequence is moved past the largest one.
+        """
+
+        rows = self._rows(objs_in)
+        if not rows:
+            return []
+        # only the fields sent are overwritten, `created` keeps the first insert
+        fields = set(rows[0]) - set(index_elements) - {"created"}
+        if hasattr(self.model, "modified"):
+            fields.add("modified")
+
+        def on_conflict(statement):
+            return statement.on_conflict_do_update(
+                index_elements=index_elements,
+                set_={field: statement.excluded[field] for field in fields},
+            )
+
+        return await self._insert_many(db, rows, batch_size, on_conflict=on_conflict)
+
+    async def update_many(
+        self,
+        db: AsyncSession,
+        *,
+        objs_in: Sequence[UpdateSchemaType | dict[str, Any]]
+    ) -> list[ModelType]:
+        """
+        Update rows by their `id`, each with its own fields. Rows that set the
+        same fields share one executemany `UPDATE` (`onupdate` defaults such
+        as `modified` still apply), then the updated rows are read back with
+        one `SELECT`. Missing ids are skipped.
+        """
+        groups: dict[tuple[str, ...], list[dict[str, Any]]] = {}
+        ids = []
+        for row in self._rows(objs_in, exclude_unset=True):
+            ids.append(row["id"])
+            row = {"_id": row.pop("id"), **row}
+            groups.setdefault(tuple(sorted(row)), []).append(row)
+        table = self.model.__table__
+        for fields, rows in groups.items():
+            statement = (
+                update(table)
+                .where(table.c.id == bindparam("_id"))
+                .values({field: bindparam(field) for field in fields if field != "_id"})
+            )
+            await db.execute(statement, rows)
+        await self._commit_bulk(db)
+        rows_by_id = {row.id: row for row in await self.get_by_ids(db, ids)}
+        return [rows_by_id[id] for id in ids if id in rows_by_id]
+
+    async def copy_many(
+        self,
+        db: AsyncSession,
+        *,
+        objs_in: Iterable[CreateSchemaType | dict[str, Any]],
+        columns: Sequence[str]
+    ) -> int:
+        """
+        Load rows with the `COPY` protocol of asyncpg, the fastest path for
+        very large batches. Only `columns` are sent, plus the timestamps; rows
+        are not returned and `id` comes from its sequence. Returns the number
+        of rows copied.
+        """
+        columns = list(columns)
+        defaults = {
+            column.name: column.default.arg
+            for column in self.model.__table__.columns
+            if column.name not in columns
+            and column.default is not None
+            and column.default.is_callable
+        }
+        records = [
+            tuple(row.get(column) for column in columns)
+            + tuple(default(None) for default in defaults.values())
+            for row in self._rows(objs_in)
+        ]
+        connection = await db.connection()
+        raw_connection = await connection.get_raw_connection()
+        await raw_connection.driver_connection.copy_records_to_table(
+            self.model.__tablename__,
+            records=records,
+            columns=columns + list(defaults),
+        )
+        if "id" in columns:
+            position = columns.index("id")
+            await self._advance_id_sequence(
+                db, [record[position] for record in records]
+            )
+        await self._commit_bulk(db)
+        return len(records)
+
+    def _rows(
+        self, objs_in: Iterable[BaseModel | dict[str, Any]], exclude_unset: bool = False
+    ) -> list[dict[str, Any]]:
+        # not jsonable_encoder, column types like timestamptz need python values
+        return [
+            obj_in.dict(exclude_unset=exclude_unset)
+            if isinstance(obj_in, BaseModel)
+            else dict(obj_in)
+            for obj_in in objs_in
+        ]
+
+    async def _insert_many(
+        self,
+        db: AsyncSession,
+        rows: list[dict[str, Any]],
+        batch_size: int,
+        on_conflict=None,
+    ) -> list[ModelType]:
+        if not rows:
+            return []
+        # timestamps and other python defaults are filled in for every row
+        batch_size = min(batch_size, MAX_PARAMS // len(self.model.__table__.columns))
+        created = []
+        for start in range(0, len(rows), batch_size):
+            end = start + batch_size
+            statement = pg_insert(self.model).values(rows[start:end])
+            if on_conflict is not None:
+                statement = on_conflict(statement)
+            query = (
+                select(self.model)
+                .from_statement(statement.returning(*self.model.__table__.columns))
+                .execution_options(populate_existing=True)
+            )
+            created.extend((await db.scalars(query)).all())
+        await self._advance_id_sequence(db, [row.get("id") for row in rows])
+        await self._commit_bulk(db)
+        return created
+
+    async def _advance_id_sequence(self, db: AsyncSession, ids: list[Any]) -> None:
+        # rows inserted with their own ids don't move the sequence, the next
+        # insert that takes its id from it would collide. One statement moves
+        # it to the largest id in the table, never below its current value.
+        if all(id is None for id in ids):
+            return
+        sequence = func.pg_get_serial_sequence(f'"{self.model.__tablename__}"', "id")
+        last_value = func.pg_sequence_last_value(cast(sequence, REGCLASS))
+        max_id = select(func.max(self.model.id)).scalar_subquery()
+        await db.execute(
+            select(func.setval(sequence, func.greatest(max_id, last_value)))
+        )
+
+    async def _commit_bulk(self, db: AsyncSession) -> None:
+        if not db.info.get(UNIT_OF_WORK_KEY):
+            await db.commit()
+
     def update(
         self,
         db: Session | AsyncSession,
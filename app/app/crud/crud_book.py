@@ -4,12 +4,17 @@ from typing import Any, Dict, Union, Awaitable
 from fastapi.encoders import jsonable_encoder
 from sqlalchemy.orm import Session
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import and_, asc, bindparam, case, desc, func, or_, tuple_, update
 from sqlalchemy.future import select
 
 from app.crud.base import CRUDBase
+from app.models.user import User
 from app.models.book import *
 from app.schemas.book import TakenBookStatus
 
+# taken books not returned yet
+OPEN_STATUSES = (TakenBookStatus().TAKEN, TakenBookStatus().OVERDUE)
+
 
 class CRUDBook(CRUDBase[Book, Book, Book]):
     def get_by_id(
@@ -22,6 +27,121 @@ class CRUDBook(CRUDBase[Book, Book, Book]):
         query = select(Book)
         return self._all(db.scalars(query))
 
+    def change_stock(
+        self, db: Session | AsyncSession, book_id: int, delta: int
+    ) -> Book | None | Awaitable[Book | None]:
+        """
+        Add `delta` to the amount of the book in one `UPDATE ... RETURNING`,
+        without committing. None if the book is missing or out of stock.
+        """
+        statement = (
+            update(Book).where(Book.id == book_id).values(amount=Book.amount + delta)
+        )
+        if delta < 0:
+            statement = statement.where(Book.amount >= -delta)
+        return self._update_returning(db, statement)
+
+    def rent_copy(
+        self, db: Session | AsyncSession, book_id: int
+    ) -> Book | None | Awaitable[Book | None]:
+        """
+        Take one copy for a rental and count the borrow in one
+        `UPDATE ... RETURNING`, without committing. None if the book is
+        missing or out of stock.
+        """
+        statement = (
+            update(Book)
+            .where(Book.id == book_id, Book.amount >= 1)
+            .values(
+                amount=Book.amount - 1,
+                borrow_count=Book.borrow_count + 1,
+                recent_borrow_count=Book.recent_borrow_count + 1,
+                out_count=Book.out_count + 1,
+            )
+        )
+        return self._update_returning(db, statement)
+
+    def return_copy(
+        self, db: Session | AsyncSession, book_id: int
+    ) -> Book | None | Awaitable[Book | None]:
+        """Put a returned copy back in stock, without committing."""
+        statement = (
+            update(Book)
+            .where(Book.id == book_id)
+            .values(
+                amount=Book.amount + 1,
+                out_count=func.greatest(Book.out_count - 1, 0),
+            )
+        )
+        return self._update_returning(db, statement)
+
+    def get_id_range(
+        self, db: Session | AsyncSession
+    ) -> tuple[int | None, int | None] | Awaitable[tuple[int | None, int | None]]:
+        return self._first(db.execute(select(func.min(Book.id), func.max(Book.id))))
+
+    async def recompute_borrow_counters(
+        self,
+        db: AsyncSession,
+        *,
+        first_id: int,
+        last_id: int,
+        since: datetime.datetime
+    ) -> int:
+        """
+        Recount the borrow counters of the books with an id in [`first_id`,
+        `last_id`] from their rentals (sold books don't count), without
+        committing. `recent_borrow_count` counts the rentals taken at or after
+        `since`. Only the books whose counters drifted are written; returns
+        how many.
+
+        The books are locked first, so the counts are read after every rental
+        or return already holding one of them commits, and later ones wait and
+        apply on top of the recount.
+        """
+        await db.execute(
+            select(Book.id)
+            .filter(Book.id.between(first_id, last_id))
+            .order_by(Book.id)
+            .with_for_update()
+        )
+        stats = (
+            select(
+                Book.id.label("id"),
+                func.count(TakenBook.id).label("total"),
+                func.count(TakenBook.id)
+                .filter(TakenBook.taken_date >= since)
+                .label("recent"),
+                func.count(TakenBook.id).filter(CRUDTakenBook.is_open()).label("out"),
+            )
+            .outerjoin(
+                TakenBook,
+                and_(
+                    TakenBook.book == Book.id,
+                    TakenBook.status != TakenBookStatus().SOLD,
+                ),
+            )
+            .filter(Book.id.between(first_id, last_id))
+            .group_by(Book.id)
+            .subquery()
+        )
+        counters = tuple_(Book.borrow_count, Book.recent_borrow_count, Book.out_count)
+        statement = (
+            update(Book)
+            .where(
+                Book.id == stats.c.id,
+                counters.is_distinct_from(
+                    tuple_(stats.c.total, stats.c.recent, stats.c.out)
+                ),
+            )
+            .values(
+                borrow_count=stats.c.total,
+                recent_borrow_count=stats.c.recent,
+                out_count=stats.c.out,
+            )
+        )
+        return (await db.execute(statement)).rowcount
+
     async def create(self, db: Session | AsyncSession, *, obj_in: Book) -> Book:
         obj_in_data = jsonable_encoder(obj_in)
         obj_in_data = {k: v for k, v in obj_in_data.items() if v is not None}
@@ -50,6 +170,43 @@ class CRUDTakenBook(CRUDBase[TakenBook, TakenBook, TakenBook]):
         query = select(TakenBook).filter(TakenBook.user == u_id)
         return self._all(db.scalars(query))
 
+    @staticmethod
+    def is_open():
+        """
+        Filter of the taken books not returned yet. The statuses are rendered
+        inline so the planner can use the partial index on open rentals.
+        """
+        return TakenBook.status.in_(
+            bindparam(
+                "open_statuses", OPEN_STATUSES, expanding=True, literal_execute=True
+            )
+        )
+
+    def get_open_rentals(
+        self, db: Session | AsyncSession, *, user_id: int | None = None
+    ):
+        """Taken books not returned yet, of one user if `user_id` is given."""
+        query = select(TakenBook).filter(self.is_open())
+        if user_id is not None:
+            query = query.filter(TakenBook.user == user_id)
+        return self._all(db.scalars(query))
+
+    def count_open_in_category(
+        self, db: Session | AsyncSession, user_id: int, category_id: int
+    ) -> int | Awaitable[int]:
+        """How many books of the category the user has taken and not returned yet."""
+        query = (
+            select(func.count())
+            .select_from(TakenBook)
+            .join(Book, Book.id == TakenBook.book)
+            .filter(
+                TakenBook.user == user_id,
+                self.is_open(),
+                Book.category == category_id,
+            )
+        )
+        return db.scalar(query)
+
     def get_books_per_user(self, db: Session | AsyncSession, u_id: int):
         query = select(TakenBook.book).filter(TakenBook.user == u_id).distinct()
         return self._all(db.scalars(query))
@@ -58,19 +215,187 @@ class CRUDTakenBook(CRUDBase[TakenBook, TakenBook, TakenBook]):
         query = select(TakenBook).filter(TakenBook.book == b_id)
         return self._all(db.scalars(query))
 
+    async def count_by_books(
+        self, db: AsyncSession, book_ids: list[int]
+    ) -> dict[int, int]:
+        """
+        How many times each book was taken, sold ones included, in one
+        GROUP BY query. Books never taken are left out.
+        """
+        query = (
+            select(TakenBook.book, func.count())
+            .filter(TakenBook.book.in_(book_ids))
+            .group_by(TakenBook.book)
+        )
+        return dict((await db.execute(query)).all())
+
     def get_all(self, db: Session | AsyncSession):
         query = select(TakenBook)
         return self._all(db.scalars(query))
 
+    async def get_statistics(
+        self, db: AsyncSession
+    ) -> list[tuple[int | None, int, int, float]]:
+        """
+        (category, status, count, bill sum) of taken books in one GROUP BY query.
+        Category is None for taken books whose book is gone.
+        """
+        query = (
+            select(
+                Book.category,
+                TakenBook.status,
+                func.count(),
+                func.coalesce(func.sum(TakenBook.bill), 0),
+            )
+            .select_from(TakenBook)
+            .outerjoin(Book, Book.id == TakenBook.book)
+            .group_by(Book.category, TakenBook.status)
+        )
+        return (await db.execute(query)).all()
+
+    async def get_violations(
+        self,
+        db: AsyncSession,
+        *,
+        most_first: bool = True,
+        limit: int = 100,
+        offset: int = 0
+    ) -> list[tuple[int, str, int]]:
+        """
+        (user id, email, overdue count) of users with overdue taken books.
+        Counting runs on the (status, user) index and only the users of the
+        page are joined for their email.
+        """
+        direction = desc if most_first else asc
+        violations = func.count().label("violations")
+        counts = (
+            select(TakenBook.user, violations)
+            .filter(TakenBook.status.in_(
+                [TakenBookStatus().OVERDUE, TakenBookStatus().OVERDUE_DELIVERED]
+            ))
+            .group_by(TakenBook.user)
+            .order_by(direction(violations), TakenBook.user)
+            .limit(limit)
+            .offset(offset)
+            .subquery()
+        )
+        query = (
+            select(counts.c.user, User.email, counts.c.violations)
+            .join(User, User.id == counts.c.user)
+            .order_by(direction(counts.c.violations), counts.c.user)
+        )
+        return (await db.execute(query)).all()
+
     def get_undelivered_tbs(self, db: Session | AsyncSession):
-        query = select(TakenBook).filter(TakenBook.status == TakenBookStatus().TAKEN
-                                         or TakenBook.status == TakenBookStatus().OVERDUE)
-        return self._all(db.scalars(query))
+        return self.get_open_rentals(db)
 
     async def create(self, db: Session | AsyncSession, *, obj_in: TakenBook) -> TakenBook:
-        obj_in_data = jsonable_encoder(obj_in)
-        obj_in_data = {k: v for k, v in obj_in_data.items() if v is not None and type(v) != datetime.datetime}
-        return await super().create(db, obj_in=obj_in_data)
+        # not jsonable_encoder, the dates stay datetimes for the timestamptz columns
+        obj_in_data = {k: v for k, v in obj_in.dict().items() if v is not None}
+        db_obj = TakenBook(**obj_in_data)
+        db.add(db_obj)
+        return await self._commit_refresh(db=db, db_obj=db_obj)
+
+    @classmethod
+    def is_billable(cls, today: datetime.date):
+        """Filter of the taken books not returned yet and not billed on `today`."""
+        return and_(
+            cls.is_open(),
+            or_(TakenBook.last_billed.is_(None), TakenBook.last_billed < today),
+        )
+
+    def get_billing_chunk_end(
+        self,
+        db: Session | AsyncSession,
+        *,
+        after_id: int,
+        size: int,
+        today: datetime.date
+    ) -> int | None | Awaitable[int | None]:
+        """
+        Largest id of the next `size` taken books to bill on `today` with an id
+        above `after_id`, None when there are none left. The ids are read in
+        order from the primary key index, however sparse they are.
+        """
+        chunk = (
+            select(TakenBook.id)
+            .filter(TakenBook.id > after_id, self.is_billable(today))
+            .order_by(TakenBook.id)
+            .limit(size)
+            .subquery()
+        )
+        return db.scalar(select(func.max(chunk.c.id)))
+
+    async def bill_open_rentals(
+        self,
+        db: AsyncSession,
+        *,
+        first_id: int,
+        last_id: int,
+        now: datetime.datetime
+    ) -> tuple[int, int, float]:
+        """
+        Charge one day of rent for the taken books with an id in
+        [`first_id`, `last_id`] that are not returned yet, without committing.
+
+        One statement: an `UPDATE ... FROM` adds the rent price of the category
+        to the bill, flags the books due before `now` as overdue and marks them
+        billed on the day of `now`, and its `RETURNING` rows feed the `UPDATE`
+        that debits the balances. Taken books already billed that day are
+        skipped, so a retry or a second run doesn't charge them twice, and so
+        are the ones whose book or category is missing. Returns the number of
+        taken books billed, how many of them are overdue, and the total charged.
+        """
+        today = now.date()
+        billed = (
+            update(TakenBook)
+            .where(
+                TakenBook.id.between(first_id, last_id),
+                self.is_billable(today),
+                Book.id == TakenBook.book,
+                Category.id == Book.category,
+            )
+            .values(
+                bill=func.coalesce(TakenBook.bill, 0) + Category.rent_price,
+                last_billed=today,
+                status=case(
+                    (TakenBook.returning_date < now, TakenBookStatus().OVERDUE),
+                    else_=TakenBook.status,
+                ),
+                # SQL-side, both updates would otherwise bind a "modified" parameter
+                modified=func.now(),
+            )
+            .returning(
+                TakenBook.user.label("user"),
+                TakenBook.status.label("status"),
+                Category.rent_price.label("charge"),
+            )
+            .cte("billed")
+        )
+        charges = (
+            select(
+                billed.c.user,
+                func.sum(billed.c.charge).label("total"),
+                func.count().label("rentals"),
+                func.count()
+                .filter(billed.c.status == TakenBookStatus().OVERDUE)
+                .label("overdue"),
+            )
+            .group_by(billed.c.user)
+            .subquery()
+        )
+        statement = (
+            update(User)
+            .where(User.id == charges.c.user)
+            .values(balance=User.balance - charges.c.total, modified=func.now())
+            .returning(charges.c.rentals, charges.c.overdue, charges.c.total)
+        )
+        rows = (await db.execute(statement)).all()
+        return (
+            sum(row.rentals for row in rows),
+            sum(row.overdue for row in rows),
+            sum(row.total for row in rows),
+        )
 
     def update(
         self,
@@ -2,6 +2,7 @@ from typing import Any, Dict, Union, Awaitable
 
 from fastapi.encoders import jsonable_encoder
 from sqlalchemy.orm import Session
+from sqlalchemy import update
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
@@ -24,6 +25,26 @@ class CRUDUser(CRUDBase[User, UserCreate, UserUpdate]):
         query = select(User).filter(User.id == uid)
         return self._first(db.scalars(query))
 
+    def change_balance(
+        self,
+        db: Session | AsyncSession,
+        uid: int,
+        delta: float,
+        *,
+        allow_negative: bool = False
+    ) -> User | None | Awaitable[User | None]:
+        """
+        Add `delta` to the balance of the user in one `UPDATE ... RETURNING`,
+        without committing. None if the user is missing or, unless
+        `allow_negative` is set, can't afford a debit.
+        """
+        statement = (
+            update(User).where(User.id == uid).values(balance=User.balance + delta)
+        )
+        if delta < 0 and not allow_negative:
+            statement = statement.where(User.balance >= -delta)
+        return self._update_returning(db, statement)
+
     async def create(self, db: Session | AsyncSession, *, obj_in: UserCreate) -> User:
         obj_in_data = jsonable_encoder(obj_in)
         obj_in_data["hashed_password"] = get_password_hash(obj_in.password)
@@ -92,6 +92,17 @@ async def validation_exceptions_handler(request: Request, exc: Any):
     return response
 
 
+async def handle_exception(request: Request, exc: Exception):
+    """Answer `exc` with the handler the app registers for it."""
+    if isinstance(exc, InternalServiceError):
+        return await internal_service_exceptions_handler(request, exc)
+    if isinstance(exc, RequestValidationError):
+        return await validation_exceptions_handler(request, exc)
+    if isinstance(exc, HTTPException):
+        return await http_exception_handler(request, exc)
+    return await internal_exceptions_handler(request, exc)
+
+
 http_exceptions = (HTTPException, http_exception_handler)
 internal_exceptions = (Exception, internal_exceptions_handler)
 internal_service_exceptions = (
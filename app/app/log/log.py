@@ -1,40 +1,230 @@
+import asyncio
 import logging
 import json
-from typing import Callable
+import random
+from contextlib import suppress
+from fnmatch import fnmatchcase
+from typing import Any, Callable
 
 from fastapi import Request, BackgroundTasks
 from fastapi.routing import APIRoute
 from fastapi.responses import Response
 
-from app import crud, schemas, exceptions
+from app import crud, models, schemas, exceptions
+from app.core.config import settings
 from app.db.session import async_session
 
 
 logger = logging.getLogger(__name__)
 
+REQUEST_LOG_COLUMNS = list(schemas.RequestLogCreate.__fields__)
+OVERFLOW_POLICIES = ("drop", "block")
+# a warning is logged for the first dropped log and then every this many
+DROP_WARNING_EVERY = 1000
+TRUNCATED_MARKER = "...[truncated {} bytes]"
+REDACTED = "[redacted]"
+# longest value each length-limited column takes; a longer one fails the COPY
+# of the whole batch
+REQUEST_LOG_MAX_LENGTHS = {
+    column.name: column.type.length
+    for column in models.RequestLog.__table__.columns
+    if getattr(column.type, "length", None)
+}
+
+
+def fit_request_log(values: dict[str, Any]) -> dict[str, Any]:
+    """Cut the string values down to the length of their columns."""
+    return {
+        name: value[: REQUEST_LOG_MAX_LENGTHS[name]]
+        if isinstance(value, str) and name in REQUEST_LOG_MAX_LENGTHS
+        else value
+        for name, value in values.items()
+    }
+
+
+class RequestLogPolicy:
+    """
+    Which requests are logged and how much of them is kept: glob patterns on
+    the path to include or exclude, the share of successful requests sampled
+    (errors are always logged), a cap on the captured bodies and the
+    redaction of the `authorization` header.
+    """
+
+    def __init__(
+        self,
+        include: list[str] = (),
+        exclude: list[str] = (),
+        sample_rate: float = 1.0,
+        max_body_bytes: int = 4096,
+        redact_authorization: bool = True,
+    ) -> None:
+        self.include = list(include)
+        self.exclude = list(exclude)
+        self.sample_rate = sample_rate
+        self.max_body_bytes = max_body_bytes
+        self.redact_authorization = redact_authorization
+
+    def should_log(self, path: str, status_code: int) -> bool:
+        if self.include and not any(
+            fnmatchcase(path, pattern) for pattern in self.include
+        ):
+            return False
+        if any(fnmatchcase(path, pattern) for pattern in self.exclude):
+            return False
+        if status_code >= 400:
+            return True
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def capture_body(self, body: bytes) -> str:
+        captured = body[: self.max_body_bytes].decode(errors="replace")
+        if len(body) > self.max_body_bytes:
+            captured += TRUNCATED_MARKER.format(len(body) - self.max_body_bytes)
+        return captured
+
+    def capture_authorization(self, authorization: str | None) -> str | None:
+        if not authorization or not self.redact_authorization:
+            return authorization
+        # keep the scheme, e.g. "Bearer [redacted]"
+        scheme, _, credentials = authorization.partition(" ")
+        return f"{scheme} {REDACTED}" if credentials else REDACTED
+
+
+class RequestLogWriter:
+    """
+    Queues request logs in this worker and writes them with one `COPY` per
+    batch: as soon as `batch_size` logs are waiting, or every `flush_interval`
+    seconds. When the queue is full a log is dropped, or with
+    `overflow="block"` the caller waits for room. `close` writes what is left.
+    """
+
+    def __init__(
+        self,
+        batch_size: int,
+        flush_interval: float,
+        max_size: int,
+        overflow: str = "drop",
+    ) -> None:
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow must be one of {OVERFLOW_POLICIES}")
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_size = max_size
+        self.overflow = overflow
+        self.written = 0
+        self.dropped = 0
+        self.queue: asyncio.Queue | None = None
+        self._batch_ready: asyncio.Event | None = None
+        self._closing = False
+        self._flusher: asyncio.Task | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._flusher is not None
+
+    async def start(self) -> None:
+        self.queue = asyncio.Queue(self.max_size)
+        self._batch_ready = asyncio.Event()
+        self._closing = False
+        self._flusher = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """Stop the flusher and write the logs still queued."""
+        if self._flusher is None:
+            return
+        self._closing = True
+        self._batch_ready.set()
+        await self._flusher
+        self._flusher = None
+        while batch := self._take():
+            await self._write(batch)
+
+    async def put(self, log: dict[str, Any]) -> None:
+        if self.overflow == "block":
+            await self.queue.put(log)
+        else:
+            try:
+                self.queue.put_nowait(log)
+            except asyncio.QueueFull:
+                self.dropped += 1
+                if self.dropped % DROP_WARNING_EVERY == 1:
+                    logger.warning(
+                        "Request log queue is full, %s logs dropped", self.dropped
+                    )
+                return
+        if self.queue.qsize() >= self.batch_size:
+            self._batch_ready.set()
+
+    async def _run(self) -> None:
+        while not self._closing:
+            if self.queue.qsize() < self.batch_size:
+                with suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(
+                        self._batch_ready.wait(), self.flush_interval
+                    )
+            self._batch_ready.clear()
+            batch = self._take()
+            if batch:
+                await self._write(batch)
+
+    def _take(self) -> list[dict[str, Any]]:
+        batch = []
+        while len(batch) < self.batch_size and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        return batch
+
+    async def _write(self, batch: list[dict[str, Any]]) -> None:
+        try:
+            async with async_session() as db:
+                await crud.request_log.copy_many(
+                    db, objs_in=batch, columns=REQUEST_LOG_COLUMNS
+                )
+            self.written += len(batch)
+        except Exception:
+            logger.exception("Could not write %s request logs", len(batch))
+
+
+request_log_policy = RequestLogPolicy(
+    include=settings.REQUEST_LOG_INCLUDE_ROUTES,
+    exclude=settings.REQUEST_LOG_EXCLUDE_ROUTES,
+    sample_rate=settings.REQUEST_LOG_SAMPLE_RATE,
+    max_body_bytes=settings.REQUEST_LOG_MAX_BODY_BYTES,
+    redact_authorization=settings.REQUEST_LOG_REDACT_AUTHORIZATION,
+)
+request_log_writer = RequestLogWriter(
+    batch_size=settings.REQUEST_LOG_BATCH_SIZE,
+    flush_interval=settings.REQUEST_LOG_FLUSH_INTERVAL,
+    max_size=settings.REQUEST_LOG_QUEUE_SIZE,
+    overflow=settings.REQUEST_LOG_OVERFLOW,
+)
+
 
 async def save_request_log_async(
     request: Request, response: Response = None, trace_back: str = ""
 ) -> None:
-    authorization = request.headers.get("authorization")
+    authorization = request_log_policy.capture_authorization(
+        request.headers.get("authorization")
+    )
     client_host = request.client.host
     service_name = request.url.path
     method = request.method
     request_data = {
-        "body": {},
+        "body": "",
         "path_params": str(request.path_params),
         "query_params": str(request.query_params),
     }
 
     response_data = ""
     if response:
-        if "json" not in response.headers.get("content-type"):
+        body = getattr(response, "body", None)
+        if body is None or "json" not in response.headers.get("content-type", ""):
+            # streamed and non-json responses are logged by their headers
             response_data = json.dumps(dict(response.headers))
         else:
-            response_data = str(response.body)
+            response_data = request_log_policy.capture_body(body)
 
     try:
-        request_data["body"] = await request.json()
+        # read by the endpoint already, the bytes are cached on the request
+        request_data["body"] = request_log_policy.capture_body(await request.body())
     except Exception as e:
         pass
 
@@ -48,10 +238,13 @@ async def save_request_log_async(
         "trace": trace_back,
     }
 
-    request_log_in = schemas.RequestLogCreate(**request_log_data)
+    request_log_in = schemas.RequestLogCreate(**fit_request_log(request_log_data))
+    if request_log_writer.running:
+        await request_log_writer.put(request_log_in.dict())
+        return
+    # no writer outside the app (scripts, tests): write it right away
     async with async_session() as db:
         await crud.request_log.create(db=db, obj_in=request_log_in)
-        await db.commit()
 
 
 class LogRoute(APIRoute):
@@ -59,18 +252,25 @@ class LogRoute(APIRoute):
         original_route_handler = super().get_route_handler()
 
         async def custom_route_handler(request: Request) -> Response:
+            trace_back = ""
             try:
                 response: Response = await original_route_handler(request)
             except Exception as e:
                 response = await exceptions.handle_exception(request, e)
-                return response
+                _, _, trace_back = exceptions.get_traceback_info(e)
 
+            if not request_log_policy.should_log(
+                request.url.path, response.status_code
+            ):
+                return response
             if not response.background:
                 tasks = BackgroundTasks()
-                tasks.add_task(save_request_log_async, request, response)
+                tasks.add_task(save_request_log_async, request, response, trace_back)
                 response.background = tasks
             else:
-                response.background.add_task(save_request_log_async, request, response)
+                response.background.add_task(
+                    save_request_log_async, request, response, trace_back
+                )
             return response
 
         return custom_route_handler
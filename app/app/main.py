@@ -5,8 +5,10 @@ from starlette.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.api import deps
 from app.api.api_v1.api import api_router
 from app.core.config import settings
+from app.log.log import request_log_writer
 from app.models import User
 from app.exceptions import (
     http_exceptions,
@@ -49,4 +51,19 @@ async def startup():
         prefix="api-cache",
         response_header="X-API-Cache",
         ignore_arg_types=[Request, Response, Session, AsyncSession, User],
+        local_max_items=settings.CACHE_LOCAL_MAX_ITEMS,
+        local_max_bytes=settings.CACHE_LOCAL_MAX_BYTES,
+        local_ttl=settings.CACHE_LOCAL_TTL,
+        codec=settings.CACHE_CODEC,
+        compression=settings.CACHE_COMPRESSION,
+        compression_min_size=settings.CACHE_COMPRESSION_MIN_SIZE,
+        claims_resolver=deps.get_token_claims,
+        backend=settings.CACHE_BACKEND,
     )
+    await request_log_writer.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await request_log_writer.close()
+    await Cache().close()
@@ -1,4 +1,6 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Float, DateTime
+from sqlalchemy import (
+    Boolean, Column, ForeignKey, Index, Integer, String, Float, Date, DateTime, text
+)
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from app.db.base_class import Base
@@ -23,19 +25,37 @@ class Book(Base):
     amount = Column(Integer, index=True)
     serial_number = Column(String, index=True)
     sell_price = Column(Float, index=True)
+    # kept up to date by rentals and returns, recounted nightly
+    # (recent_borrow_count only ages out then)
+    borrow_count = Column(Integer, nullable=False, default=0, server_default="0")
+    recent_borrow_count = Column(Integer, nullable=False, default=0, server_default="0")
+    out_count = Column(Integer, nullable=False, default=0, server_default="0")
 
 
 class TakenBook(Base):
     __tablename__ = "takenbooks"
+    __table_args__ = (
+        # violations: overdue rows grouped by user, read from the index alone
+        Index("ix_takenbooks_status_user", "status", "user"),
+        # times a book was taken within a date range
+        Index("ix_takenbooks_book_taken_date", "book", "taken_date"),
+        # open rentals (TAKEN, OVERDUE), a small slice of the history
+        Index(
+            "ix_takenbooks_open_user_book", "user", "book",
+            postgresql_where=text("status IN (0, 2)"),
+        ),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     book = Column(Integer, ForeignKey("books.id"))
     # book_ref = relationship("Book", back_populates="takenbooks")
     user = Column(Integer, ForeignKey("user.id"))
     # user_ref = relationship("User", back_populates="takenbooks")
-    taken_date = Column(String, index=True)
-    returning_date = Column(String, index=True)
+    taken_date = Column(DateTime(timezone=True), index=True)
+    returning_date = Column(DateTime(timezone=True), index=True)
     valid_borrowed_days = Column(Integer, index=True)
     status = Column(Integer, index=True)
     bill = Column(Float, index=True)
+    # day of the last daily rent charge, so billing runs at most once a day
+    last_billed = Column(Date)
 
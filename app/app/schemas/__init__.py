@@ -1,5 +1,7 @@
 from .msg import Msg
 from .user import User, UserCreate, UserInDB, UserUpdate, UserBase, UserInDBBase, LoginUser
-from .book import Book, TakenBook, Category
+from .book import (
+    Book, BookUpdate, BookUpsert, TakenBook, Category, CategoryUpdate, CategoryUpsert
+)
 from .token import Token, TokenPayload, RefreshToken
 from .request_log import RequestLogCreate, RequestLogUpdate
@@ -1,8 +1,7 @@
 import datetime
-from dateutil import parser
 from .user import User
 
-from pydantic import BaseModel
+from pydantic import BaseModel, validator
 
 
 class Category(BaseModel):
@@ -12,6 +11,18 @@ class Category(BaseModel):
     overdue_penalty: float
 
 
+class CategoryUpsert(Category):
+    id: int
+
+
+class CategoryUpdate(BaseModel):
+    id: int
+    name: str | None
+    limit: int | None
+    rent_price: float | None
+    overdue_penalty: float | None
+
+
 class Book(BaseModel):
     category: int
     amount: int
@@ -22,6 +33,20 @@ class Book(BaseModel):
     def from_db(db_obj):
         return Book(category=db_obj.category, amount=db_obj.amount, name=db_obj.name, serial_number=db_obj.serial_number)
 
+
+class BookUpsert(Book):
+    id: int
+
+
+class BookUpdate(BaseModel):
+    id: int
+    category: int | None
+    amount: int | None
+    name: str | None
+    serial_number: str | None
+    sell_price: float | None
+
+
 class TakenBookStatus(BaseModel):
     RECEIVED = 1
     TAKEN = 0
@@ -38,10 +63,16 @@ class TakenBook(BaseModel):
     bill: float = 0.0
     status: int = 0
 
+    @validator("taken_date", "returning_date")
+    def assume_utc(cls, value: datetime.datetime | None):
+        # dates are stored as timestamptz, naive ones are taken as UTC
+        if value is not None and value.tzinfo is None:
+            return value.replace(tzinfo=datetime.timezone.utc)
+        return value
+
     @staticmethod
     def from_db(db_obj):
-        taken_date = parser.parse(db_obj.taken_date)
-        # returning_date = datetime.datetime.strptime(db_obj.returning_date, 'YYYY-MM-DDTHH:MM:SS. mmmmmm')
-        returning_date = parser.parse(db_obj.returning_date)
-        return TakenBook(book=db_obj.book, user=db_obj.user, taken_date=taken_date, returning_date=returning_date,
+        return TakenBook(book=db_obj.book, user=db_obj.user,
+                         taken_date=db_obj.taken_date,
+                         returning_date=db_obj.returning_date,
                          status=db_obj.status, bill=db_obj.bill, valid_borrowed_days=db_obj.valid_borrowed_days)
\ No newline at end of file
@@ -3,5 +3,7 @@ from .response import (
     APIErrorResponse,
     APIResponse,
     APIResponseType,
+    APIStreamingResponse,
+    CursorContent,
     PaginatedContent,
 )
@@ -1,8 +1,9 @@
+import json
 from abc import ABC
-from typing import Generic, TypeVar
+from typing import Any, AsyncIterable, AsyncIterator, Callable, Generic, TypeVar
 
 from fastapi.encoders import jsonable_encoder
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import Field
 from pydantic.generics import GenericModel
 from starlette.responses import Response
@@ -32,6 +33,16 @@ class PaginatedContent(GenericModel, Generic[T]):
     offset: int = 0
 
 
+class CursorContent(GenericModel, Generic[T]):
+    """Content data type for lists with cursor pagination"""
+
+    data: T
+    limit: int = 100
+    # opaque tokens of the neighbouring pages, None when there is no such page
+    next_cursor: str | None = None
+    prev_cursor: str | None = None
+
+
 class APIResponseType(GenericModel, Generic[T]):
     """
     an api response type for using as the api's router response_model
@@ -102,3 +113,65 @@ class APIErrorResponse(JSONResponse):
             if isinstance(args[0], Response):
                 return args[0]
         return super().__new__(cls)
+
+
+class APIStreamingResponse(StreamingResponse):
+    """
+    Streams batches of items as the list content of an APIResponse,
+    or as newline-delimited JSON (one item per line) when `ndjson` is set.
+    Each batch is encoded and sent on its own, so the whole list is never
+    held in memory. Errors raised after the first chunk can't change the
+    status code anymore and end the response early.
+    """
+
+    def __init__(
+        self,
+        batches: AsyncIterable[list],
+        ndjson: bool = False,
+        msg_code: int = 0,
+        msg_status: int = 0,
+        encoder: Callable[[Any], Any] = jsonable_encoder,
+        **kwargs,
+    ):
+        self.encoder = encoder
+        if ndjson:
+            content = self.ndjson_chunks(batches)
+            media_type = "application/x-ndjson"
+        else:
+            header = {
+                "status": msg_status,
+                "message": utils.MessageCodes.messages_names[msg_code],
+                "persianMessage": utils.MessageCodes.persian_message_names[
+                    msg_code
+                ],
+                "messageCode": msg_code,
+            }
+            content = self.json_chunks(batches, header)
+            media_type = "application/json"
+        super().__init__(content, media_type=media_type, **kwargs)
+
+    def dumps(self, item: Any) -> str:
+        # same output as JSONResponse.render
+        return json.dumps(
+            self.encoder(item),
+            ensure_ascii=False,
+            allow_nan=False,
+            indent=None,
+            separators=(",", ":"),
+        )
+
+    async def ndjson_chunks(self, batches: AsyncIterable[list]) -> AsyncIterator[bytes]:
+        async for batch in batches:
+            if batch:
+                yield "".join(self.dumps(item) + "\n" for item in batch).encode()
+
+    async def json_chunks(
+        self, batches: AsyncIterable[list], header: dict
+    ) -> AsyncIterator[bytes]:
+        yield ('{"header":' + self.dumps(header) + ',"content":[').encode()
+        separator = ""
+        async for batch in batches:
+            if batch:
+                yield (separator + ",".join(map(self.dumps, batch))).encode()
+                separator = ","
+        yield b"]}"
@@ -2,15 +2,8 @@ import logging
 from rocketry import Rocketry
 from rocketry.conds import daily, after_success
 
-from app import crud
-from app.api import deps
-from app.core.library_management import add_bill_to_tbs
-from app.db.session import SessionLocal
-
-from sqlalchemy.orm import Session
-from sqlalchemy.ext.asyncio import AsyncSession
-
-from fastapi import APIRouter, Body, Depends
+from app.core.library_management import bill_taken_books, recompute_book_counters
+from app.db.session import async_session
 
 logging.basicConfig(format="%(asctime)s - %(message)s", level=logging.INFO)
 logger = logging.getLogger(__file__)
@@ -27,14 +20,25 @@ async def test_rocketry():
 
 # @app.task(daily)
 @app.task(daily)
-async def check_taken_books_bills(*, db: AsyncSession = Depends(deps.get_db_async)):
-    db = SessionLocal()
+async def check_taken_books_bills():
     logger.info("(Daily) Checking Taken Books Bills")
-    tbs = crud.taken_book.get_undelivered_tbs(db)
-    logger.info(f"(Daily) Processing {len(tbs)} Books")
     # apply daily bill to users those have taken books & check if a taken book is overdue or not
-    await add_bill_to_tbs(db, tbs)
-    logger.info("(Daily) Finished Checking Taken Books Bills Successfully")
+    async with async_session() as db:
+        progress = await bill_taken_books(db)
+    logger.info(
+        "(Daily) Finished Checking Taken Books Bills Successfully: "
+        f"{progress.rentals} books ({progress.overdue} overdue) "
+        f"in {progress.chunks} chunks, {progress.elapsed:.1f}s"
+    )
+
+@app.task(daily)
+async def recompute_books_counters():
+    logger.info("(Daily) Recomputing Book Counters")
+    async with async_session() as db:
+        corrected = await recompute_book_counters(db)
+    logger.info(
+        f"(Daily) Finished Recomputing Book Counters: {corrected} books corrected"
+    )
 
 if __name__ == "__main__":
     app.run()
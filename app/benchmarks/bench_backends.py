@@ -0,0 +1,56 @@
+"""Benchmark cache hit latency of each backend.
+
+Reads the same cached value through `Cache.check_cache` with the in-memory
+backend, Redis with the in-process cache in front of it, and Redis alone.
+
+Run from the `app` folder; the Redis rows are skipped if it is not reachable:
+
+    REDIS_URL=redis://localhost:6379/15 python -m benchmarks.bench_backends
+"""
+import asyncio
+import logging
+import os
+import time
+
+from cache import Cache
+
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/15")
+HITS = 10_000
+KEY = "bench:hit"
+VALUE = b"x" * 1024
+LOCAL_LIMITS = {"local_max_items": 1000, "local_max_bytes": 10**7}
+
+BACKENDS = [
+    ("memory", {"backend": "memory", **LOCAL_LIMITS}),
+    ("redis + local", {"host_url": REDIS_URL, "local_ttl": 60, **LOCAL_LIMITS}),
+    ("redis", {"host_url": REDIS_URL}),
+]
+
+
+async def measure(name: str, options: dict) -> None:
+    cache = Cache()
+    await cache.init(prefix="bench", **options)
+    if cache.not_connected:
+        print(f"{name:>14} | skipped, {REDIS_URL} is not reachable")
+        return
+    try:
+        await cache.add_to_cache(KEY, VALUE, 60)
+        started = time.perf_counter()
+        for _ in range(HITS):
+            await cache.check_cache(KEY)
+        elapsed = (time.perf_counter() - started) / HITS * 1_000_000
+        print(f"{name:>14} | {elapsed:>10.1f}")
+    finally:
+        await cache.close()
+
+
+async def main() -> None:
+    # check_cache logs every hit
+    logging.getLogger("cache.client").setLevel(logging.WARNING)
+    print(f"{'backend':>14} | {'hit (us)':>10}")
+    for name, options in BACKENDS:
+        await measure(name, options)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,83 @@
+"""Benchmark inserting categories one by one and in bulk.
+
+Compares rows/sec of `crud.category.create` in a loop (one INSERT and commit
+per row), `create_many` (multi-row INSERT ... RETURNING) and `copy_many`
+(asyncpg COPY). The rows are deleted after each run.
+
+Run from the `app` folder against a migrated database; it is skipped if the
+database is not reachable:
+
+    python -m benchmarks.bench_bulk_insert
+"""
+import asyncio
+import time
+
+from sqlalchemy import delete
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import crud, schemas
+from app.db.session import async_session, engine_async
+from app.models.book import Category
+
+ROWS = [100, 1_000, 10_000]
+NAME_PREFIX = "bench-bulk-"
+
+
+def make_rows(count: int) -> list[schemas.Category]:
+    return [
+        schemas.Category(
+            name=f"{NAME_PREFIX}{i}", limit=3, rent_price=1.5, overdue_penalty=0.5
+        )
+        for i in range(count)
+    ]
+
+
+async def one_by_one(db: AsyncSession, rows: list[schemas.Category]) -> None:
+    for row in rows:
+        await crud.category.create(db, obj_in=row)
+
+
+async def create_many(db: AsyncSession, rows: list[schemas.Category]) -> None:
+    await crud.category.create_many(db, objs_in=rows)
+
+
+async def copy_many(db: AsyncSession, rows: list[schemas.Category]) -> None:
+    columns = schemas.Category.__fields__.keys()
+    await crud.category.copy_many(db, objs_in=rows, columns=columns)
+
+
+PATHS = [("one by one", one_by_one), ("create_many", create_many), ("copy", copy_many)]
+
+
+async def measure(count: int, name: str, insert) -> None:
+    rows = make_rows(count)
+    async with async_session() as db:
+        try:
+            started = time.perf_counter()
+            await insert(db, rows)
+            elapsed = time.perf_counter() - started
+        finally:
+            await db.rollback()
+            await db.execute(
+                delete(Category).where(Category.name.startswith(NAME_PREFIX))
+            )
+            await db.commit()
+    print(f"{count:>8} | {name:>12} | {count / elapsed:>10.0f}")
+
+
+async def main() -> None:
+    try:
+        async with engine_async.connect():
+            pass
+    except Exception as e:
+        print(f"skipped, the database is not reachable: {e}")
+        return
+    print(f"{'rows':>8} | {'path':>12} | {'rows/sec':>10}")
+    for count in ROWS:
+        for name, insert in PATHS:
+            await measure(count, name, insert)
+    await engine_async.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,68 @@
+"""Benchmark namespace invalidation latency against the number of cached keys.
+
+Compares the previous `KEYS pattern` + `DELETE` strategy with the generation
+counter used by `Cache.invalidate_namespace`.
+
+Run from the `app` folder against a disposable Redis database:
+
+    REDIS_URL=redis://localhost:6379/15 python -m benchmarks.bench_cache_invalidate
+"""
+
+import asyncio
+import os
+import time
+
+import redis.asyncio as redis
+
+from cache import Cache
+
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/15")
+SIZES = [1_000, 10_000, 100_000, 1_000_000]
+NAMESPACE = "user"
+FILL_BATCH = 10_000
+
+
+async def fill(client: redis.Redis, cache: Cache, size: int) -> None:
+    await client.flushdb()
+    version = await cache.get_namespace_version(NAMESPACE)
+    for start in range(0, size, FILL_BATCH):
+        async with client.pipeline(transaction=False) as pipe:
+            for i in range(start, min(start + FILL_BATCH, size)):
+                key = (
+                    f"{cache.prefix}|{NAMESPACE}:{version}:bench.read_user(user_id={i})"
+                )
+                pipe.set(key, b"{}", ex=3600)
+            await pipe.execute()
+
+
+async def keys_and_delete(client: redis.Redis, pattern: str) -> None:
+    keys = await client.keys(pattern=pattern)
+    if keys:
+        await client.delete(*keys)
+
+
+async def main() -> None:
+    client = redis.from_url(REDIS_URL)
+    cache = Cache()
+    await cache.init(host_url=REDIS_URL, prefix="bench")
+    pattern = cache.get_cache_key_pattern(NAMESPACE)
+
+    print(f"{'keys':>10} | {'KEYS+DEL (ms)':>14} | {'INCR (ms)':>10}")
+    for size in SIZES:
+        await fill(client, cache, size)
+        started = time.perf_counter()
+        await keys_and_delete(client, pattern)
+        legacy = (time.perf_counter() - started) * 1000
+
+        await fill(client, cache, size)
+        started = time.perf_counter()
+        await cache.invalidate_namespace(NAMESPACE)
+        versioned = (time.perf_counter() - started) * 1000
+        print(f"{size:>10} | {legacy:>14.2f} | {versioned:>10.3f}")
+
+    await client.flushdb()
+    await client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
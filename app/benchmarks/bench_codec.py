@@ -0,0 +1,97 @@
+"""Benchmark the cache codecs on a list payload of 100 users.
+
+Measures encode and decode time, the encoded size and, when a Redis server is
+reachable at `REDIS_URL`, the memory Redis reports for the stored value.
+Codecs whose optional package (`orjson`, `msgpack`, `zstandard`, `lz4`) is not
+installed are skipped.
+
+Run from the `app` folder:
+
+    REDIS_URL=redis://localhost:6379/15 python -m benchmarks.bench_codec
+"""
+import asyncio
+import os
+from timeit import timeit
+
+import redis.asyncio as redis
+
+from app import schemas
+from cache.codec import Codec
+
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/15")
+CALLS = 1_000
+USERS = 100
+CODECS = [
+    ("json", None),
+    ("json", "zstd"),
+    ("json", "lz4"),
+    ("orjson", None),
+    ("orjson", "zstd"),
+    ("orjson", "lz4"),
+    ("msgpack", None),
+    ("msgpack", "zstd"),
+    ("msgpack", "lz4"),
+]
+
+
+def make_payload() -> list:
+    return [
+        schemas.User(
+            id=i,
+            email=f"user{i}@example.com",
+            full_name=f"User Number {i}",
+            is_active=i % 7 != 0,
+            is_superuser=i == 0,
+            balance=i * 12.5,
+        )
+        for i in range(USERS)
+    ]
+
+
+async def memory_usage(client: redis.Redis | None, data: bytes) -> str:
+    if client is None:
+        return "n/a"
+    await client.set("bench-codec", data)
+    usage = await client.memory_usage("bench-codec")
+    await client.delete("bench-codec")
+    return str(usage)
+
+
+async def connect() -> redis.Redis | None:
+    client = redis.from_url(REDIS_URL)
+    try:
+        await client.ping()
+    except (redis.ConnectionError, OSError):
+        await client.close()
+        return None
+    return client
+
+
+async def main() -> None:
+    payload = make_payload()
+    client = await connect()
+    print(
+        f"{'codec':<16} | {'encode (us)':>11} | {'decode (us)':>11} "
+        f"| {'bytes':>6} | {'redis bytes':>11}"
+    )
+    for format, compression in CODECS:
+        name = f"{format}+{compression}" if compression else format
+        try:
+            codec = Codec(format, compression, compression_min_size=0)
+        except ImportError as e:
+            print(f"{name:<16} | skipped ({e.name} is not installed)")
+            continue
+        data = codec.encode(payload)
+        encode = timeit(lambda: codec.encode(payload), number=CALLS) / CALLS * 1e6
+        decode = timeit(lambda: codec.decode(data), number=CALLS) / CALLS * 1e6
+        memory = await memory_usage(client, data)
+        print(
+            f"{name:<16} | {encode:>11.1f} | {decode:>11.1f} "
+            f"| {len(data):>6} | {memory:>11}"
+        )
+    if client is not None:
+        await client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
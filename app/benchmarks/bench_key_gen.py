@@ -0,0 +1,65 @@
+"""Microbenchmark for building one cache key per call.
+
+Compares the previous builder (signature + bind + `str()` of every argument on
+each call) with a `KeyPlan` computed once per function.
+
+Run from the `app` folder:
+
+    python -m benchmarks.bench_key_gen
+"""
+from inspect import signature
+from timeit import timeit
+
+from fastapi import Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from cache.key_gen import KeyPlan, get_cache_key
+
+CALLS = 100_000
+PREFIX = "api-cache|user:0"
+IGNORE_ARG_TYPES = [Request, Response, AsyncSession]
+
+
+async def read_users(
+    db: AsyncSession, skip: int = 0, limit: int = 100, email: str | None = None
+):
+    ...
+
+
+def legacy_get_cache_key(prefix, ignore_arg_types, func, *args, **kwargs):
+    ignore_arg_types.extend([Response, Request])
+    ignore_arg_types = list(set(ignore_arg_types))
+    sig = signature(func)
+    func_args = sig.bind(*args, **kwargs)
+    func_args.apply_defaults()
+    args_str = ",".join(
+        f"{arg}={val}"
+        for arg, val in func_args.arguments.items()
+        if sig.parameters[arg].annotation not in ignore_arg_types
+    )
+    return f"{prefix}:{func.__module__}.{func.__name__}({args_str})"
+
+
+def main() -> None:
+    kwargs = {"db": object(), "skip": 200, "limit": 100, "email": "a@b.c"}
+    plan = KeyPlan(read_users, IGNORE_ARG_TYPES)
+
+    cases = {
+        # the legacy builder extended the shared ignore list on every call, which
+        # made each call slower than the last; a fresh copy hides that growth
+        "legacy (bind + str per call)": lambda: legacy_get_cache_key(
+            PREFIX, list(IGNORE_ARG_TYPES), read_users, **kwargs
+        ),
+        "get_cache_key (plan per call)": lambda: get_cache_key(
+            PREFIX, IGNORE_ARG_TYPES, read_users, **kwargs
+        ),
+        "KeyPlan.build (plan reused)": lambda: plan.build(PREFIX, **kwargs),
+    }
+    for name, case in cases.items():
+        seconds = timeit(case, number=CALLS)
+        print(f"{name:<32} {seconds / CALLS * 1e6:8.2f} us/key")
+    print(f"example key: {plan.build(PREFIX, **kwargs)}")
+
+
+if __name__ == "__main__":
+    main()
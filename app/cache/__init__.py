@@ -4,3 +4,4 @@ from cache.cache import (
     invalidate,
 )
 from cache.client import Cache
+from cache.route import CacheRoute
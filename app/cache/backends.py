@@ -0,0 +1,335 @@
+"""backends.py"""
+import asyncio
+import json
+import logging
+from abc import ABC, abstractmethod
+from fnmatch import fnmatchcase
+from time import monotonic
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from redis.asyncio import client
+
+from cache.local import LocalCache
+
+INVALIDATE_BATCH = 1000
+RESUBSCRIBE_DELAY = 1
+RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class CacheBackend(ABC):
+    """Storage used by `Cache`.
+
+    Keys are built by `Cache`; tag sets and generation counters are addressed by
+    the keys it passes in, so backends only store and expire bytes.
+    """
+
+    async def start(self) -> None:
+        """Start background work once `Cache` is ready to use the backend."""
+
+    async def close(self) -> None:
+        """Stop background work and release connections."""
+
+    @abstractmethod
+    async def get_with_ttl(self, key: str) -> Tuple[int, Optional[bytes]]:
+        """Return the remaining seconds and the value of `key` (None if missing)."""
+
+    @abstractmethod
+    async def set(
+        self, key: str, value: bytes, expire: int, tag_keys: Iterable[str] = ()
+    ) -> bool:
+        """Store `value` for `expire` seconds and add `key` to every tag set."""
+
+    @abstractmethod
+    async def get_generation(self, version_key: str) -> int:
+        """Return the counter stored at `version_key`, 0 if it was never bumped."""
+
+    @abstractmethod
+    async def incr_generation(self, version_key: str, key_prefix: str) -> int:
+        """Bump the counter at `version_key`.
+
+        Keys starting with `key_prefix` belong to the previous generation and
+        will not be read again; backends may drop them right away.
+        """
+
+    @abstractmethod
+    async def invalidate_tags(self, tag_keys: Iterable[str]) -> List[str]:
+        """Delete the keys stored with any of `tag_keys` and return them."""
+
+    @abstractmethod
+    async def delete_pattern(self, pattern: str) -> None:
+        """Delete every key matching the glob-style `pattern`."""
+
+    @abstractmethod
+    async def acquire_lock(self, lock_key: str, token: str, timeout: int) -> bool:
+        """Take `lock_key` for `timeout` seconds unless someone else holds it."""
+
+    @abstractmethod
+    async def release_lock(self, lock_key: str, token: str) -> None:
+        """Release `lock_key` if it is still held with `token`."""
+
+
+class RedisBackend(CacheBackend):
+    """Stores entries in Redis, shared by every worker."""
+
+    def __init__(self, redis: client.Redis) -> None:
+        self.redis = redis
+
+    async def close(self) -> None:
+        await self.redis.close()
+
+    async def get_with_ttl(self, key: str) -> Tuple[int, Optional[bytes]]:
+        async with self.redis.pipeline() as pipe:
+            ttl, value = await pipe.ttl(key).get(key).execute()
+        return ttl, value
+
+    async def set(
+        self, key: str, value: bytes, expire: int, tag_keys: Iterable[str] = ()
+    ) -> bool:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.set(name=key, value=value, ex=expire)
+            for tag_key in tag_keys:
+                # the tag set lives as long as its longest-lived key
+                pipe.sadd(tag_key, key)
+                pipe.expire(tag_key, expire, nx=True)
+                pipe.expire(tag_key, expire, gt=True)
+            return bool((await pipe.execute())[0])
+
+    async def get_generation(self, version_key: str) -> int:
+        return int(await self.redis.get(version_key) or 0)
+
+    async def incr_generation(self, version_key: str, key_prefix: str) -> int:
+        # old keys are left to their TTL, deleting them would need a keyspace scan
+        return await self.redis.incr(version_key)
+
+    async def invalidate_tags(self, tag_keys: Iterable[str]) -> List[str]:
+        """Read the tag sets and unlink their keys in two pipelined round trips.
+
+        Only the members read are removed from the sets, so keys tagged while
+        this runs stay tracked.
+        """
+        tag_keys = list(tag_keys)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for tag_key in tag_keys:
+                pipe.smembers(tag_key)
+            members = await pipe.execute()
+        keys = set().union(*members)
+        if not keys:
+            return []
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.unlink(*keys)
+            for tag_key, tag_members in zip(tag_keys, members):
+                if tag_members:
+                    pipe.srem(tag_key, *tag_members)
+            await pipe.execute()
+        return [key.decode() for key in keys]
+
+    async def delete_pattern(self, pattern: str) -> None:
+        """Uses incremental SCAN/UNLINK so the server is never blocked."""
+        batch = []
+        async for key in self.redis.scan_iter(match=pattern, count=INVALIDATE_BATCH):
+            batch.append(key)
+            if len(batch) >= INVALIDATE_BATCH:
+                await self.redis.unlink(*batch)
+                batch = []
+        if batch:
+            await self.redis.unlink(*batch)
+
+    async def acquire_lock(self, lock_key: str, token: str, timeout: int) -> bool:
+        return bool(await self.redis.set(lock_key, token, nx=True, ex=timeout))
+
+    async def release_lock(self, lock_key: str, token: str) -> None:
+        await self.redis.eval(RELEASE_LOCK_SCRIPT, 1, lock_key, token)
+
+
+class InMemoryBackend(CacheBackend):
+    """Stores entries in this process with per-entry TTL and LRU eviction.
+
+    Needs no Redis server, but every worker has its own entries, locks and
+    generations: use it for tests, benchmarks and single-process deployments.
+    """
+
+    def __init__(self, max_items: int, max_bytes: int) -> None:
+        self.entries = LocalCache(
+            max_items, max_bytes, float("inf"), on_delete=self._forget_tags
+        )
+        self.generations: Dict[str, int] = {}
+        self.tags: Dict[str, Set[str]] = {}
+        # key -> tag sets it belongs to, so evicted keys leave their tag sets
+        self.key_tags: Dict[str, Set[str]] = {}
+        # lock key -> (token, expiry)
+        self.locks: Dict[str, Tuple[str, float]] = {}
+
+    async def get_with_ttl(self, key: str) -> Tuple[int, Optional[bytes]]:
+        # -2 is what Redis answers for a missing key
+        return self.entries.get(key) or (-2, None)
+
+    async def set(
+        self, key: str, value: bytes, expire: int, tag_keys: Iterable[str] = ()
+    ) -> bool:
+        if not self.entries.set(key, value, expire):
+            return False
+        for tag_key in tag_keys:
+            self.tags.setdefault(tag_key, set()).add(key)
+            self.key_tags.setdefault(key, set()).add(tag_key)
+        return True
+
+    async def get_generation(self, version_key: str) -> int:
+        return self.generations.get(version_key, 0)
+
+    async def incr_generation(self, version_key: str, key_prefix: str) -> int:
+        self.generations[version_key] = self.generations.get(version_key, 0) + 1
+        self.entries.delete_prefix(key_prefix)
+        return self.generations[version_key]
+
+    async def invalidate_tags(self, tag_keys: Iterable[str]) -> List[str]:
+        keys = set()
+        for tag_key in tag_keys:
+            keys.update(self.tags.pop(tag_key, ()))
+        for key in keys:
+            self.entries.delete(key)
+        return list(keys)
+
+    async def delete_pattern(self, pattern: str) -> None:
+        for key in self.entries.keys():
+            if fnmatchcase(key, pattern):
+                self.entries.delete(key)
+
+    async def acquire_lock(self, lock_key: str, token: str, timeout: int) -> bool:
+        now = monotonic()
+        held = self.locks.get(lock_key)
+        if held and held[1] > now:
+            return False
+        self.locks[lock_key] = (token, now + timeout)
+        return True
+
+    async def release_lock(self, lock_key: str, token: str) -> None:
+        held = self.locks.get(lock_key)
+        if held and held[0] == token:
+            del self.locks[lock_key]
+
+    def _forget_tags(self, key: str) -> None:
+        for tag_key in self.key_tags.pop(key, ()):
+            tag = self.tags.get(tag_key)
+            if tag is not None:
+                tag.discard(key)
+                if not tag:
+                    del self.tags[tag_key]
+
+
+class LayeredBackend(CacheBackend):
+    """A per-worker `LocalCache` in front of Redis.
+
+    Reads are served from memory when possible and writes go to both. When a
+    worker invalidates a namespace or tags, it publishes the change on `channel`
+    and every worker drops the affected local entries.
+    """
+
+    def __init__(self, local: LocalCache, remote: RedisBackend, channel: str) -> None:
+        self.local = local
+        self.remote = remote
+        self.channel = channel
+        self._listener: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        self._listener = asyncio.create_task(self._listen_invalidations())
+
+    async def close(self) -> None:
+        if self._listener:
+            self._listener.cancel()
+            self._listener = None
+        await self.remote.close()
+
+    async def get_with_ttl(self, key: str) -> Tuple[int, Optional[bytes]]:
+        cached = self.local.get(key)
+        if cached:
+            return cached
+        ttl, value = await self.remote.get_with_ttl(key)
+        if value:
+            self.local.set(key, value, ttl)
+        return ttl, value
+
+    async def set(
+        self, key: str, value: bytes, expire: int, tag_keys: Iterable[str] = ()
+    ) -> bool:
+        cached = await self.remote.set(key, value, expire, tag_keys)
+        if cached:
+            self.local.set(key, value, expire)
+        return cached
+
+    async def get_generation(self, version_key: str) -> int:
+        cached = self.local.get(version_key)
+        if cached:
+            return int(cached[1])
+        version = await self.remote.get_generation(version_key)
+        self.local.set(version_key, str(version).encode(), self.local.max_ttl)
+        return version
+
+    async def incr_generation(self, version_key: str, key_prefix: str) -> int:
+        version = await self.remote.incr_generation(version_key, key_prefix)
+        invalidation = {
+            "type": "namespace",
+            "version_key": version_key,
+            "prefix": key_prefix,
+        }
+        self.drop_local(invalidation)
+        await self.publish(invalidation)
+        return version
+
+    async def invalidate_tags(self, tag_keys: Iterable[str]) -> List[str]:
+        keys = await self.remote.invalidate_tags(tag_keys)
+        if keys:
+            invalidation = {"type": "keys", "keys": keys}
+            self.drop_local(invalidation)
+            await self.publish(invalidation)
+        return keys
+
+    async def delete_pattern(self, pattern: str) -> None:
+        await self.remote.delete_pattern(pattern)
+        for key in self.local.keys():
+            if fnmatchcase(key, pattern):
+                self.local.delete(key)
+
+    async def acquire_lock(self, lock_key: str, token: str, timeout: int) -> bool:
+        return await self.remote.acquire_lock(lock_key, token, timeout)
+
+    async def release_lock(self, lock_key: str, token: str) -> None:
+        await self.remote.release_lock(lock_key, token)
+
+    async def publish(self, invalidation: Dict) -> None:
+        """Tell every worker to drop the local entries described by `invalidation`."""
+        await self.remote.redis.publish(self.channel, json.dumps(invalidation))
+
+    def drop_local(self, invalidation: Dict) -> None:
+        if invalidation["type"] == "keys":
+            for key in invalidation["keys"]:
+                self.local.delete(key)
+        else:
+            self.local.delete(invalidation["version_key"])
+            self.local.delete_prefix(invalidation["prefix"])
+
+    async def _listen_invalidations(self) -> None:
+        """Drop local entries whenever any worker invalidates a namespace or tags."""
+        while True:
+            pubsub = self.remote.redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(self.channel)
+                # messages may have been missed while (re)subscribing
+                self.local.clear()
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    self.drop_local(json.loads(message["data"]))
+            except asyncio.CancelledError:
+                await pubsub.close()
+                raise
+            except Exception as e:  # pragma: no cover
+                logger.warning("Invalidation subscription failed: %s", e)
+                await pubsub.close()
+                await asyncio.sleep(RESUBSCRIBE_DELAY)
@@ -3,128 +3,455 @@ from ast import pattern
 import asyncio
 from datetime import timedelta
 from functools import partial, update_wrapper, wraps
-from http import HTTPStatus
-from typing import Union
+from inspect import Parameter, Signature, signature
+from math import log
+from random import random
+from time import monotonic
+from typing import Any, Awaitable, Callable, List, Mapping, Sequence, Union
 
-from fastapi import Response
+from fastapi import BackgroundTasks, Request, Response
+from fastapi.dependencies.utils import get_typed_return_annotation
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from pydantic.fields import ModelField
+from pydantic.utils import lenient_issubclass
 
 from cache.client import Cache
+from cache.enums import RedisEvent
+from cache.types import RouteCacheOptions
 from cache.util import (
-    deserialize_json,
     ONE_DAY_IN_SECONDS,
     ONE_HOUR_IN_SECONDS,
     ONE_MONTH_IN_SECONDS,
     ONE_WEEK_IN_SECONDS,
     ONE_YEAR_IN_SECONDS,
-    serialize_json,
 )
 
+LOCK_TIMEOUT = 10
+LOCK_WAIT = 2
+LOCK_POLL_INTERVAL = 0.05
+INJECTED_BACKGROUND_TASKS_ARG = "cache_background_tasks"
+INJECTED_REQUEST_ARG = "cache_request"
+INJECTED_ARGS = (INJECTED_BACKGROUND_TASKS_ARG, INJECTED_REQUEST_ARG)
+CACHE_OPTIONS_ATTR = "__cache_options__"
+# request scope entry holding the key `CacheRoute` looked up
+ROUTE_CACHE_KEY = "cache_key"
+# longest a response keyed by token claims is served without the endpoint's checks
+CLAIMS_MAX_TTL = 300
+
+# a format string over the call's keyword arguments, or a callable over its result
+Tag = Union[str, Callable[[Any], List[str]]]
+
 
 def cache(
-    *, namespace: str | None = None, expire: int | timedelta = ONE_YEAR_IN_SECONDS
+    *,
+    namespace: str | None = None,
+    expire: int | timedelta = ONE_YEAR_IN_SECONDS,
+    stale_ttl: int | timedelta = 0,
+    early_refresh: float = 0,
+    lock_timeout: int = LOCK_TIMEOUT,
+    lock_wait: float = LOCK_WAIT,
+    response_model: Any = None,
+    as_response: bool = True,
+    vary_headers: Sequence[str] = (),
+    vary_claims: Sequence[str] = (),
+    tags: Sequence[Tag] = (),
 ):
     """Enable caching behavior for the decorated function.
 
+    The rendered response body is cached, so a hit returns the stored bytes as a
+    `Response` without deserializing and re-encoding them. Concurrent misses on
+    the same key are coalesced: within a worker they await a single computation,
+    across workers a short Redis lock lets one process recompute while the others
+    wait for its result.
+
     Args:
         expire (Union[int, timedelta], optional): The number of seconds
             from now when the cached response should expire. Defaults to 31,536,000
             seconds (i.e., the number of seconds in one year).
         namespace (str|None, optional): cache namespace for expiration usage
+        stale_ttl (Union[int, timedelta], optional): grace period after `expire`
+            during which the expired value is still served while a background
+            task recomputes it. Defaults to 0 (disabled).
+        early_refresh (float, optional): XFetch `beta`; when greater than 0 a fresh
+            value is refreshed in the background with a probability that rises as
+            it nears expiry. 1 is a sensible value. Defaults to 0 (disabled).
+        lock_timeout (int, optional): seconds after which a recompute lock held
+            by a crashed worker is released. Defaults to 10.
+        lock_wait (float, optional): seconds to wait for another worker's result
+            before computing the value anyway. Defaults to 2.
+        response_model (Any, optional): model the response is rendered with.
+            Defaults to the return annotation of the endpoint; set it when the
+            route declares `response_model=` instead, since FastAPI does not apply
+            it to the `Response` returned here.
+        as_response (bool, optional): set to False to cache a plain function,
+            which then returns the decoded value instead of a `Response`.
+            Defaults to True.
+        vary_headers (Sequence[str], optional): request headers whose values are
+            part of the key when the endpoint is served by `CacheRoute`.
+        vary_claims (Sequence[str], optional): token claims (e.g. `sub`) that are
+            part of the key when the endpoint is served by `CacheRoute`. Endpoints
+            behind authentication are only served before their dependencies run
+            when this is set. `expire` is then capped to 5 minutes, so a user
+            deactivated without `invalidate(claims=...)` stops getting hits
+            soon, and responses are sent with `Cache-Control: private`.
+        tags (Sequence[Union[str, Callable]], optional): tags stored with each
+            cached value so `invalidate(tags=...)` can drop it. A string is
+            formatted with the keyword arguments of the call (`"user:{user_id}"`),
+            a callable receives the value returned by the function and returns
+            a list of tags.
     """
 
     def outer_wrapper(func):
+        ttl = calculate_ttl(expire)
+        if vary_claims:
+            ttl = min(ttl, CLAIMS_MAX_TTL)
+        options = RouteCacheOptions(
+            namespace=namespace,
+            expire=ttl,
+            stale_ttl=calculate_ttl(stale_ttl),
+            early_refresh=early_refresh,
+            vary_headers=tuple(vary_headers),
+            vary_claims=tuple(vary_claims),
+        )
+        injected = {}
+        background_tasks_arg = get_injected_arg(
+            func, BackgroundTasks, INJECTED_BACKGROUND_TASKS_ARG, injected
+        )
+        request_arg = None
+        response_field = None
+        if as_response:
+            request_arg = get_injected_arg(
+                func, Request, INJECTED_REQUEST_ARG, injected
+            )
+            response_field = get_response_field(func, response_model)
+
         @wraps(func)
         async def inner_wrapper(*args, **kwargs):
             """Return cached value if one exists, otherwise evaluate the wrapped function and cache the result."""
 
-            func_kwargs = kwargs.copy()
-            request = func_kwargs.pop("request", None)
-            response = func_kwargs.pop("response", None)
-            create_response_directly = not response
-            if create_response_directly:
-                response = Response()
+            background_tasks = pop_injected_arg(kwargs, background_tasks_arg)
+            request = pop_injected_arg(kwargs, request_arg)
             redis_cache = Cache()
             if redis_cache.not_connected or redis_cache.request_is_not_cacheable(
                 request
             ):
                 # if the redis client is not connected or request is not cacheable, no caching behavior is performed.
                 return await get_api_response_async(func, *args, **kwargs)
-            key = redis_cache.get_cache_key(func, namespace, *args, **kwargs)
-            ttl, in_cache = await redis_cache.check_cache(key)
-            if in_cache:
-                return deserialize_json(in_cache)
-                redis_cache.set_response_headers(
-                    response, True, deserialize_json(in_cache), ttl
+
+            # filled by `compute`, stored along with the value
+            call_tags = []
+
+            async def compute():
+                started = monotonic()
+                response_data = await get_api_response_async(func, *args, **kwargs)
+                call_tags[:] = resolve_tags(tags, kwargs, response_data)
+                if as_response:
+                    response_data = await render_response(response_field, response_data)
+                options.delta = monotonic() - started
+                return response_data
+
+            load = redis_cache.load_response if as_response else redis_cache.decode
+            # set when `CacheRoute` already looked the request up and missed
+            key = request.scope.get(ROUTE_CACHE_KEY) if request else None
+            if key is None:
+                version = await redis_cache.get_namespace_version(namespace)
+                key = redis_cache.get_cache_key(
+                    func, namespace, version, *args, **kwargs
                 )
-                if redis_cache.requested_resource_not_modified(request, in_cache):
-                    response.status_code = int(HTTPStatus.NOT_MODIFIED)
-                    return (
-                        Response(
-                            content=None,
-                            status_code=response.status_code,
-                            media_type="application/json",
-                            headers=response.headers,
+            ttl = options.expire
+            grace = options.stale_ttl
+            remaining_ttl, in_cache = await redis_cache.check_cache(key)
+            cache_hit = bool(in_cache)
+            if cache_hit:
+                fresh_ttl = remaining_ttl - grace
+                if fresh_ttl <= 0 or should_refresh_early(
+                    fresh_ttl, options.delta, early_refresh
+                ):
+                    if background_tasks is not None:
+                        background_tasks.add_task(
+                            refresh,
+                            redis_cache,
+                            key,
+                            ttl + grace,
+                            lock_timeout,
+                            compute,
+                            call_tags,
                         )
-                        if create_response_directly
-                        else response
-                    )
-                return (
-                    Response(
-                        content=in_cache,
-                        media_type="application/json",
-                        headers=response.headers,
-                    )
-                    if create_response_directly
-                    else deserialize_json(in_cache)
-                )
-            response_data = await get_api_response_async(func, *args, **kwargs)
-            ttl = calculate_ttl(expire)
-            
-            cached = await redis_cache.add_to_cache(key, response_data, ttl)
-            return response_data
-            if cached:
-                redis_cache.set_response_headers(
-                    response, cache_hit=False, response_data=response_data, ttl=ttl
-                )
-                return (
-                    Response(
-                        content=serialize_json(response_data),
-                        media_type="application/json",
-                        headers=response.headers,
-                    )
-                    if create_response_directly
-                    else response_data
+                    elif fresh_ttl <= 0:
+                        # nowhere to refresh in the background, treat as a miss
+                        cache_hit = False
+            if cache_hit:
+                redis_cache.stats.hits += 1
+                response_data = load(in_cache)
+                max_age = max(fresh_ttl, 0)
+            else:
+                redis_cache.stats.misses += 1
+                response_data = await compute_once(
+                    redis_cache,
+                    key,
+                    ttl + grace,
+                    lock_timeout,
+                    lock_wait,
+                    compute,
+                    load,
+                    call_tags,
                 )
-            return response_data
+                max_age = ttl
+            if not as_response:
+                return response_data
+            return redis_cache.make_response(
+                response_data, request, cache_hit, max_age, bool(vary_claims)
+            )
 
+        if injected:
+            inner_wrapper.__signature__ = add_injected_params(func, injected)
+        if as_response:
+            setattr(inner_wrapper, CACHE_OPTIONS_ATTR, options)
         return inner_wrapper
 
     return outer_wrapper
 
 
-def invalidate(*, namespace: str | None = None):
+def invalidate(
+    *,
+    namespace: str | None = None,
+    tags: Sequence[Tag] = (),
+    claims: Mapping[str, str] | None = None,
+):
     """Enable cache invalidating behavior for the decorated function.
 
     Args:
         namespace (str|None, optional): cache namespace for expiration usage
+        tags (Sequence[Union[str, Callable]], optional): drop only the cached
+            values stored with these tags. Strings are formatted with the keyword
+            arguments of the call, callables receive the value returned by the
+            function and return a list of tags.
+        claims (Mapping[str, str], optional): token claims whose cached values
+            are dropped, e.g. `{"sub": "{user_id}"}`; the values are formatted
+            like tags. See `Cache.invalidate_claims`.
     """
 
     def outer_wrapper(func):
         @wraps(func)
         async def inner_wrapper(*args, **kwargs):
-            """delete cached namespace."""
+            """Run the wrapped function, then invalidate its namespace and tags."""
+            response_data = await get_api_response_async(func, *args, **kwargs)
             redis_cache = Cache()
             if redis_cache.connected:
                 # if the redis client is not connected no caching behavior is performed.
-                pattern = redis_cache.get_cache_key_pattern(namespace)
-                await redis_cache.invalidate(pattern)
-            return await get_api_response_async(func, *args, **kwargs)
+                if namespace:
+                    await redis_cache.invalidate_namespace(namespace)
+                if tags:
+                    await redis_cache.invalidate_tags(
+                        resolve_tags(tags, kwargs, response_data)
+                    )
+                if claims:
+                    await redis_cache.invalidate_claims(
+                        {
+                            claim: value.format(**kwargs)
+                            for claim, value in claims.items()
+                        }
+                    )
+            return response_data
 
         return inner_wrapper
 
     return outer_wrapper
 
 
+async def compute_once(
+    redis_cache: Cache,
+    key: str,
+    ttl: int,
+    lock_timeout: int,
+    lock_wait: float,
+    compute: Callable[[], Awaitable],
+    load: Callable[[bytes], Any],
+    tags: Sequence[str] = (),
+):
+    """Compute and cache the value of `key`, sharing one computation between concurrent misses."""
+    inflight = redis_cache.inflight.get(key)
+    if inflight:
+        redis_cache.stats.coalesced += 1
+        try:
+            return await asyncio.shield(inflight)
+        except asyncio.CancelledError:
+            if not inflight.cancelled():
+                raise
+        # the request computing it was cancelled, not this one: take over
+        return await compute_once(
+            redis_cache, key, ttl, lock_timeout, lock_wait, compute, load, tags
+        )
+    return await run_inflight(
+        redis_cache,
+        key,
+        compute_with_lock(
+            redis_cache, key, ttl, lock_timeout, lock_wait, compute, load, tags
+        ),
+    )
+
+
+async def compute_with_lock(
+    redis_cache: Cache,
+    key: str,
+    ttl: int,
+    lock_timeout: int,
+    lock_wait: float,
+    compute: Callable[[], Awaitable],
+    load: Callable[[bytes], Any],
+    tags: Sequence[str] = (),
+):
+    """Compute and cache the value of `key` unless another worker is already doing it.
+
+    `load` turns the bytes another worker stored into the value to return.
+    `tags` is read after `compute` returns, so it may be filled by it.
+    """
+    token = await redis_cache.acquire_lock(key, lock_timeout)
+    if not token:
+        redis_cache.stats.lock_waited += 1
+        deadline = monotonic() + lock_wait
+        while monotonic() < deadline:
+            await asyncio.sleep(LOCK_POLL_INTERVAL)
+            _, in_cache = await redis_cache.check_cache(key)
+            if in_cache:
+                return load(in_cache)
+        redis_cache.stats.lock_timeouts += 1
+    try:
+        response_data = await compute()
+        await redis_cache.add_to_cache(key, response_data, ttl, tags)
+        return response_data
+    finally:
+        if token:
+            await redis_cache.release_lock(key, token)
+
+
+async def refresh(
+    redis_cache: Cache,
+    key: str,
+    ttl: int,
+    lock_timeout: int,
+    compute: Callable[[], Awaitable],
+    tags: Sequence[str] = (),
+) -> None:
+    """Recompute `key` in the background unless this or another worker already is."""
+    if key in redis_cache.inflight:
+        return
+    token = await redis_cache.acquire_lock(key, lock_timeout)
+    if not token:
+        return
+
+    async def compute_and_store():
+        response_data = await compute()
+        await redis_cache.add_to_cache(key, response_data, ttl, tags)
+        return response_data
+
+    try:
+        await run_inflight(redis_cache, key, compute_and_store())
+    except Exception as e:
+        # the cached value keeps being served until it is refreshed or expires
+        redis_cache.log(RedisEvent.FAILED_TO_REFRESH_KEY, msg=repr(e), key=key)
+    finally:
+        await redis_cache.release_lock(key, token)
+
+
+async def run_inflight(redis_cache: Cache, key: str, coro: Awaitable):
+    """Await `coro` as the in-flight computation of `key` that concurrent misses share.
+
+    If the caller is cancelled the future is cancelled too, and the misses
+    waiting on it compute the value themselves.
+    """
+    future = asyncio.get_running_loop().create_future()
+    redis_cache.inflight[key] = future
+    try:
+        response_data = await coro
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        # the exception is re-raised here; waiters (if any) get it from the future
+        future.exception()
+        raise
+    else:
+        future.set_result(response_data)
+        return response_data
+    finally:
+        redis_cache.inflight.pop(key, None)
+
+
+def resolve_tags(tags: Sequence[Tag], kwargs: dict, response_data) -> List[str]:
+    """Format string tags with `kwargs`, call callable ones with the result."""
+    resolved = []
+    for tag in tags:
+        if callable(tag):
+            resolved.extend(tag(response_data))
+        else:
+            resolved.append(tag.format(**kwargs))
+    return resolved
+
+
+def should_refresh_early(fresh_ttl: int, delta: float, beta: float) -> bool:
+    """XFetch: refresh with a probability that rises as `fresh_ttl` approaches 0.
+
+    `delta` is how long the value takes to compute, so slow endpoints start
+    refreshing earlier than fast ones.
+    """
+    if beta <= 0 or delta <= 0:
+        return False
+    return -delta * beta * log(1.0 - random()) >= fresh_ttl
+
+
+def get_injected_arg(func, annotation, injected_name: str, injected: dict) -> str:
+    """Name of the `annotation` argument of `func`, adding it to `injected` if it has none."""
+    for param in signature(func).parameters.values():
+        if param.annotation is annotation:
+            return param.name
+    injected[injected_name] = annotation
+    return injected_name
+
+
+def pop_injected_arg(kwargs: dict, name: str | None):
+    """Value of argument `name`, removed from `kwargs` if `func` does not take it."""
+    if name in INJECTED_ARGS:
+        return kwargs.pop(name, None)
+    return kwargs.get(name) if name else None
+
+
+def add_injected_params(func, injected: dict) -> Signature:
+    """Signature of `func` with extra `injected` arguments for FastAPI to provide."""
+    sig = signature(func)
+    params = list(sig.parameters.values())
+    position = len(params)
+    if params and params[-1].kind == Parameter.VAR_KEYWORD:
+        position -= 1
+    params[position:position] = [
+        Parameter(name, Parameter.KEYWORD_ONLY, annotation=annotation)
+        for name, annotation in injected.items()
+    ]
+    return sig.replace(parameters=params)
+
+
+def get_response_field(func, response_model: Any) -> ModelField | None:
+    """Response field FastAPI would build for `func`, used to render its result."""
+    if response_model is None:
+        response_model = get_typed_return_annotation(func)
+    if response_model is None or lenient_issubclass(response_model, Response):
+        return None
+    return create_response_field(name=f"Response_{func.__name__}", type_=response_model)
+
+
+async def render_response(response_field: ModelField | None, response_data) -> Response:
+    """Validate and render `response_data` the way FastAPI renders an endpoint result."""
+    if isinstance(response_data, Response):
+        return response_data
+    content = await serialize_response(
+        field=response_field, response_content=response_data
+    )
+    return JSONResponse(content)
+
+
 async def get_api_response_async(func, *args, **kwargs):
     """Helper function that allows decorator to work with both async and non-async functions."""
     return (
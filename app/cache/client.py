@@ -1,13 +1,19 @@
-import json
+import asyncio
 import logging
+import uuid
 from datetime import datetime, timedelta
-from typing import Callable, Dict, List, Optional, Tuple, Type, Union
+from http import HTTPStatus
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Type, Union
 
 from fastapi import Request, Response
+from fastapi.responses import JSONResponse
 from redis.asyncio import client
-
+from cache.backends import CacheBackend, InMemoryBackend, LayeredBackend, RedisBackend
+from cache.codec import FORMAT_IDS, Codec
 from cache.enums import RedisEvent, RedisStatus
-from cache.key_gen import get_cache_key, get_cache_key_pattern
+from cache.key_gen import KeyPlan, get_cache_key_pattern, get_route_cache_key
+from cache.local import LocalCache
+from cache.stats import CacheStats
 from cache.redis import redis_connect
 from cache.util import serialize_json
 
@@ -33,13 +39,21 @@ class MetaSingleton(type):
 
 
 class Cache(metaclass=MetaSingleton):
-    """Communicates with Redis server to cache API response data."""
+    """Caches API response data in a `CacheBackend` (Redis by default)."""
 
-    host_url: str
+    host_url: Optional[str] = None
     prefix: str = None
     response_header: str = None
     status: RedisStatus = RedisStatus.NONE
-    redis: client.Redis = None
+    backend: Optional[CacheBackend] = None
+    codec: Codec = Codec()
+    claims_resolver: Optional[Callable[[Request], Optional[Dict]]] = None
+
+    def __init__(self) -> None:
+        self.stats = CacheStats()
+        # keys being computed by this worker, shared by concurrent misses
+        self.inflight: Dict[str, asyncio.Future] = {}
+        self.key_plans: Dict[Callable, KeyPlan] = {}
 
     @property
     def connected(self):
@@ -51,15 +65,24 @@ class Cache(metaclass=MetaSingleton):
 
     async def init(
         self,
-        host_url: str,
+        host_url: Optional[str] = None,
         prefix: Optional[str] = None,
         response_header: Optional[str] = None,
         ignore_arg_types: Optional[List[Type[object]]] = None,
+        local_max_items: int = 0,
+        local_max_bytes: int = 0,
+        local_ttl: int = 0,
+        codec: str = "json",
+        compression: Optional[str] = None,
+        compression_min_size: int = 1024,
+        claims_resolver: Optional[Callable[[Request], Optional[Dict]]] = None,
+        backend: Union[str, CacheBackend] = "redis",
     ) -> None:
         """Connect to a Redis database using `host_url` and configure cache settings.
 
         Args:
-            host_url (str): URL for a Redis database.
+            host_url (str, optional): URL for a Redis database, needed by the
+                `redis` backend.
             prefix (str, optional): Prefix to add to every cache key stored in the
                 Redis database. Defaults to None.
             response_header (str, optional): Name of the custom header field used to
@@ -69,18 +92,69 @@ class Cache(metaclass=MetaSingleton):
                 are any arguments that have no effect on the response (such as a
                 `Request` or `Response` object), including their type in this list
                 will ignore those arguments when the key is created. Defaults to None.
+            local_max_items (int, optional): Maximum number of entries kept in the
+                in-process cache in front of Redis, or by the `memory` backend.
+                Defaults to 0 (disabled).
+            local_max_bytes (int, optional): Memory budget of the in-process cache
+                or of the `memory` backend in bytes. Defaults to 0 (disabled).
+            local_ttl (int, optional): Upper bound in seconds for how long an entry
+                is served from the in-process cache. Defaults to 0 (disabled).
+            codec (str, optional): Serialization format of new cache entries, one of
+                `json`, `orjson` or `msgpack`. Defaults to `json`.
+            compression (str, optional): `zstd` or `lz4` to compress new cache
+                entries. Defaults to None (no compression).
+            compression_min_size (int, optional): Entries smaller than this many
+                bytes are stored uncompressed. Defaults to 1024.
+            claims_resolver (Callable, optional): Returns the verified token claims
+                of a request, or None if it has no valid token. `CacheRoute` keys
+                responses by these claims before any dependency runs, so it must
+                check the token signature and expiry. Defaults to None.
+            backend (Union[str, CacheBackend], optional): `redis` (shared by all
+                workers, with the in-process cache in front of it when the local_*
+                limits are set), `memory` (in this process only, no Redis needed)
+                or a `CacheBackend` instance. Defaults to `redis`.
         """
         self.host_url = host_url
         self.prefix = prefix
         self.response_header = response_header or DEFAULT_RESPONSE_HEADER
         self.ignore_arg_types = ignore_arg_types
-        await self._connect()
+        self.key_plans = {}
+        self.codec = Codec(codec, compression, compression_min_size)
+        self.claims_resolver = claims_resolver
+        if isinstance(backend, CacheBackend):
+            self.backend = backend
+            self.status = RedisStatus.CONNECTED
+        elif backend == "memory":
+            if local_max_items <= 0 or local_max_bytes <= 0:
+                raise ValueError("memory backend needs local_max_items/bytes > 0")
+            self.backend = InMemoryBackend(local_max_items, local_max_bytes)
+            self.status = RedisStatus.CONNECTED
+        elif backend == "redis":
+            redis_client = await self._connect()
+            if self.connected:
+                self.backend = RedisBackend(redis_client)
+                if local_max_items > 0 and local_max_bytes > 0 and local_ttl > 0:
+                    self.backend = LayeredBackend(
+                        LocalCache(local_max_items, local_max_bytes, local_ttl),
+                        self.backend,
+                        self.invalidation_channel,
+                    )
+        else:
+            raise ValueError(f"Unknown cache backend {backend!r}")
+        if self.connected:
+            await self.backend.start()
+
+    async def close(self) -> None:
+        if self.backend:
+            await self.backend.close()
+            self.backend = None
+        self.status = RedisStatus.NONE
 
-    async def _connect(self):
+    async def _connect(self) -> Optional[client.Redis]:
         self.log(
             RedisEvent.CONNECT_BEGIN, msg="Attempting to connect to Redis server..."
         )
-        self.status, self.redis = await redis_connect(self.host_url)
+        self.status, redis_client = await redis_connect(self.host_url)
         if self.status == RedisStatus.CONNECTED:
             self.log(
                 RedisEvent.CONNECT_SUCCESS, msg="Redis client is connected to server."
@@ -95,6 +169,7 @@ class Cache(metaclass=MetaSingleton):
                 RedisEvent.CONNECT_FAIL,
                 msg="Redis server did not respond to PING message.",
             )
+        return redis_client
 
     def request_is_not_cacheable(self, request: Request) -> bool:
         return request and (
@@ -106,25 +181,104 @@ class Cache(metaclass=MetaSingleton):
         )
 
     def get_cache_key(
-        self, func: Callable, namespace: str, *args: List, **kwargs: Dict
+        self, func: Callable, namespace: str, version: int, *args: List, **kwargs: Dict
     ) -> str:
-        return get_cache_key(
-            f"{self.prefix}|{namespace}", self.ignore_arg_types, func, *args, **kwargs
+        plan = self.key_plans.get(func)
+        if plan is None:
+            plan = self.key_plans[func] = KeyPlan(func, self.ignore_arg_types)
+        return plan.build(f"{self.prefix}|{namespace}:{version}", *args, **kwargs)
+
+    async def get_route_cache_key(
+        self,
+        request: Request,
+        namespace: str,
+        version: int,
+        vary_headers: Tuple[str, ...] = (),
+        vary_claims: Tuple[str, ...] = (),
+    ) -> Optional[str]:
+        """Key of the response to `request`, or None if it has no valid token claims.
+
+        The key also embeds the generation of every claim value, so
+        `invalidate_claims` makes the entries of e.g. one user unreachable.
+        """
+        claims = []
+        if vary_claims:
+            token_claims = self.claims_resolver and self.claims_resolver(request)
+            if not token_claims:
+                return None
+            claims = [token_claims.get(claim) for claim in vary_claims]
+            for claim, value in zip(vary_claims, list(claims)):
+                claims.append(
+                    await self.backend.get_generation(
+                        self.get_claim_version_key(claim, value)
+                    )
+                )
+        return get_route_cache_key(
+            f"{self.prefix}|{namespace}:{version}",
+            request.url.path,
+            request.query_params.multi_items(),
+            [request.headers.get(header) for header in vary_headers],
+            claims,
         )
 
     def get_cache_key_pattern(self, namespace: str) -> str:
         return get_cache_key_pattern(f"{self.prefix}|{namespace}")
 
-    async def check_cache(self, key: str) -> Tuple[int, str]:
-        async with self.redis.pipeline() as pipe:
-            ttl, in_cache = await pipe.ttl(key).get(key).execute()
-            if in_cache:
-                self.log(RedisEvent.KEY_FOUND_IN_CACHE, key=key)
-            return (ttl, in_cache)
+    def get_claim_version_key(self, claim: str, value: Any) -> str:
+        return f"{self.prefix}|claim:{claim}={value}|version"
 
-    def requested_resource_not_modified(
-        self, request: Request, cached_data: str
-    ) -> bool:
+    async def invalidate_claims(self, claims: Dict[str, Any]) -> None:
+        """Make the entries cached for these token claim values unreachable.
+
+        Call it when what a claim grants changes, e.g. with `{"sub": user_id}`
+        when a user is deactivated or loses a role: hits served by `CacheRoute`
+        skip the endpoint's permission checks.
+        """
+        for claim, value in claims.items():
+            version_key = self.get_claim_version_key(claim, value)
+            # no key starts with it, there is nothing to drop right away
+            await self.backend.incr_generation(version_key, f"{version_key}:")
+            self.log(RedisEvent.NAMESPACE_INVALIDATED, key=version_key)
+
+    def get_namespace_version_key(self, namespace: str) -> str:
+        return f"{self.prefix}|{namespace}|version"
+
+    async def get_namespace_version(self, namespace: str) -> int:
+        """Return the current generation of `namespace`.
+
+        Every cache key embeds the generation of its namespace, so bumping the
+        generation makes all keys of the namespace unreachable at once.
+        """
+        return await self.backend.get_generation(
+            self.get_namespace_version_key(namespace)
+        )
+
+    async def check_cache(self, key: str) -> Tuple[int, Optional[bytes]]:
+        ttl, in_cache = await self.backend.get_with_ttl(key)
+        if in_cache:
+            self.log(RedisEvent.KEY_FOUND_IN_CACHE, key=key)
+        return (ttl, in_cache)
+
+    async def acquire_lock(self, key: str, timeout: int) -> Optional[str]:
+        """Try to take the recompute lock of `key` for `timeout` seconds.
+
+        Returns a token to release the lock with, or None if another worker
+        holds it.
+        """
+        token = uuid.uuid4().hex
+        if await self.backend.acquire_lock(f"{key}|lock", token, timeout):
+            return token
+        return None
+
+    async def release_lock(self, key: str, token: str) -> None:
+        """Release the recompute lock of `key` if it is still held with `token`."""
+        await self.backend.release_lock(f"{key}|lock", token)
+
+    def decode(self, cached_data: bytes) -> Any:
+        """Decode a value read by `check_cache`, whatever codec it was written with."""
+        return self.codec.decode(cached_data)
+
+    def requested_resource_not_modified(self, request: Request, etag: str) -> bool:
         if not request or "If-None-Match" not in request.headers:
             return False
         check_etags = [
@@ -132,46 +286,129 @@ class Cache(metaclass=MetaSingleton):
         ]
         if len(check_etags) == 1 and check_etags[0] == "*":
             return True
-        return self.get_etag(cached_data) in check_etags
+        return etag in check_etags
 
-    async def add_to_cache(self, key: str, value: Dict, expire: int) -> bool:
+    def load_response(self, cached_data: bytes) -> Response:
+        """Build a JSON response straight from the bytes read by `check_cache`."""
+        format_id, body, digest = self.codec.unpack(cached_data)
+        if format_id != FORMAT_IDS["json"]:
+            # a plain value written by another codec, render it once
+            _, loads = self.codec.get_format(format_id)
+            body = JSONResponse(loads(body)).body
+        etag = self.format_etag(digest) if digest else self.get_etag(body)
+        return Response(
+            content=body, media_type="application/json", headers={"ETag": etag}
+        )
+
+    def make_response(
+        self,
+        response: Response,
+        request: Request,
+        cache_hit: bool,
+        ttl: int,
+        private: bool = False,
+    ) -> Response:
+        """Copy `response` with cache headers, or a 304 if the client already has it.
+
+        `private` responses depend on who asks and must not be stored by
+        shared caches.
+        """
+        body = getattr(response, "body", None)
+        if body is None or response.status_code != HTTPStatus.OK:
+            # streaming and error responses are never cached, pass them through
+            return response
+        etag = response.headers.get("ETag") or self.get_etag(body)
+        if self.requested_resource_not_modified(request, etag):
+            cached_response = Response(status_code=HTTPStatus.NOT_MODIFIED)
+        else:
+            cached_response = Response(content=body, media_type=response.media_type)
+        self.set_response_headers(cached_response, cache_hit, etag, ttl, private)
+        return cached_response
+
+    async def add_to_cache(
+        self, key: str, value: Dict, expire: int, tags: Iterable[str] = ()
+    ) -> bool:
         try:
             if isinstance(value, Response):
-                response_data = value.body
+                if value.status_code != HTTPStatus.OK or not hasattr(value, "body"):
+                    return False
+                # hash the body once here, hits read the digest back with the value
+                digest = self.codec.digest(value.body)
+                response_data = self.codec.pack(FORMAT_IDS["json"], value.body, digest)
+                value.headers["ETag"] = self.format_etag(digest)
             else:
-                response_data = serialize_json(value)
+                response_data = self.codec.encode(value)
 
         except TypeError:
             message = f"Object of type {type(value)} is not JSON-serializable"
             self.log(RedisEvent.FAILED_TO_CACHE_KEY, msg=message, key=key)
             return False
-        cached = await self.redis.set(name=key, value=response_data, ex=expire)
+        tag_keys = [self.get_tag_key(tag) for tag in tags]
+        cached = await self.backend.set(key, response_data, expire, tag_keys)
         if cached:
             self.log(RedisEvent.KEY_ADDED_TO_CACHE, key=key)
         else:  # pragma: no cover
             self.log(RedisEvent.FAILED_TO_CACHE_KEY, key=key, value=value)
         return cached
 
-    async def invalidate(self, pattern: str) -> bool:
-        keys_to_delete = await self.redis.keys(pattern=pattern)
-        if keys_to_delete:
-            await self.redis.delete(*keys_to_delete)
+    async def invalidate(self, pattern: str) -> None:
+        """Delete every key matching `pattern`.
+
+        Redis uses incremental SCAN/UNLINK so the server is never blocked, but it
+        still walks the whole keyspace. Prefer `invalidate_namespace` on hot paths.
+        """
+        await self.backend.delete_pattern(pattern)
         self.log(RedisEvent.PATTERN_INVALIDATED, pattern=pattern)
 
+    async def invalidate_namespace(self, namespace: str) -> int:
+        """Invalidate every cached key of `namespace` in O(1).
+
+        Bumps the namespace generation instead of deleting keys; entries of the
+        previous generation are never read again and are reclaimed by their TTL
+        (or earlier by Redis eviction under a `volatile-*` maxmemory policy).
+        """
+        version = await self.backend.incr_generation(
+            self.get_namespace_version_key(namespace), f"{self.prefix}|{namespace}:"
+        )
+        self.log(RedisEvent.NAMESPACE_INVALIDATED, key=namespace)
+        return version
+
+    def get_tag_key(self, tag: str) -> str:
+        return f"{self.prefix}|tag:{tag}"
+
+    async def invalidate_tags(self, tags: Iterable[str]) -> int:
+        """Delete the cached keys stored with any of `tags`, returns how many."""
+        tags = list(tags)
+        if not tags:
+            return 0
+        keys = await self.backend.invalidate_tags(
+            [self.get_tag_key(tag) for tag in tags]
+        )
+        self.log(
+            RedisEvent.TAGS_INVALIDATED, msg=f"{len(keys)} keys", key=",".join(tags)
+        )
+        return len(keys)
+
+    @property
+    def invalidation_channel(self) -> str:
+        return f"{self.prefix}|invalidations"
+
     def set_response_headers(
         self,
         response: Response,
         cache_hit: bool,
-        response_data: Dict = None,
-        ttl: int = None,
+        etag: str,
+        ttl: int,
+        private: bool = False,
     ) -> None:
         response.headers[self.response_header] = "Hit" if cache_hit else "Miss"
         expires_at = datetime.utcnow() + timedelta(seconds=ttl)
         response.headers["Expires"] = expires_at.strftime(HTTP_TIME)
-        response.headers["Cache-Control"] = f"max-age={ttl}"
-        response.headers["ETag"] = self.get_etag(response_data)
-        # if "last_modified" in response_data:  # pragma: no cover
-        #     response.headers["Last-Modified"] = response_data["last_modified"]
+        cache_control = f"max-age={ttl}"
+        if private:
+            cache_control = f"private, {cache_control}"
+        response.headers["Cache-Control"] = cache_control
+        response.headers["ETag"] = etag
 
     def log(
         self,
@@ -193,13 +430,17 @@ class Cache(metaclass=MetaSingleton):
             message += f", value={value}"
         logger.info(message)
 
+    @classmethod
+    def get_etag(cls, cached_data: Union[str, bytes, Dict]) -> str:
+        if isinstance(cached_data, str):
+            cached_data = cached_data.encode()
+        elif not isinstance(cached_data, bytes):
+            cached_data = serialize_json(cached_data).encode()
+        return cls.format_etag(Codec.digest(cached_data))
+
     @staticmethod
-    def get_etag(cached_data: Union[str, bytes, Dict]) -> str:
-        if isinstance(cached_data, bytes):
-            cached_data = cached_data.decode()
-        if not isinstance(cached_data, str):
-            cached_data = serialize_json(cached_data)
-        return f"W/{hash(cached_data)}"
+    def format_etag(digest: bytes) -> str:
+        return f'W/"{digest.hex()}"'
 
     @staticmethod
     def get_log_time():
@@ -0,0 +1,169 @@
+"""codec.py"""
+from hashlib import blake2b
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from pydantic import BaseModel
+
+from cache.util import deserialize_json, jsonable_encoder, serialize_json
+
+# Every value written by `Codec` starts with one header byte:
+#   bits 0-1: serialization format, bits 2-3: compression,
+#   bit 4: the header is followed by a `DIGEST_SIZE` byte digest of the payload.
+# Header bytes stay below 0x20, which no JSON document starts with, so values
+# written before the header existed are still read as plain JSON.
+FORMAT_MASK = 0b0011
+COMPRESSION_SHIFT = 2
+COMPRESSION_MASK = 0b1100
+DIGEST_FLAG = 0b10000
+DIGEST_SIZE = 8
+DIGEST_END = DIGEST_SIZE + 1
+MAX_HEADER = 0x1F
+
+FORMAT_IDS = {"json": 1, "orjson": 2, "msgpack": 3}
+COMPRESSION_IDS = {None: 0, "zstd": 1, "lz4": 2}
+DEFAULT_COMPRESSION_MIN_SIZE = 1024
+
+Dumps = Callable[[Any], bytes]
+Loads = Callable[[bytes], Any]
+
+
+def default_encoder(obj: Any) -> Any:
+    """Fallback for types orjson and msgpack can't serialize (models, ORM objects)."""
+    if isinstance(obj, BaseModel):
+        # nested values are handed back to the codec, only unknown types come back here
+        return obj.dict(by_alias=True)
+    return jsonable_encoder(obj)
+
+
+def _json() -> Tuple[Dumps, Loads]:
+    return (lambda value: serialize_json(value).encode(), deserialize_json)
+
+
+def _orjson() -> Tuple[Dumps, Loads]:
+    import orjson
+
+    def dumps(value: Any) -> bytes:
+        return orjson.dumps(
+            value, default=default_encoder, option=orjson.OPT_NON_STR_KEYS
+        )
+
+    return dumps, orjson.loads
+
+
+def _msgpack() -> Tuple[Dumps, Loads]:
+    import msgpack
+
+    def dumps(value: Any) -> bytes:
+        return msgpack.packb(value, default=default_encoder)
+
+    def loads(data: bytes) -> Any:
+        return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+    return dumps, loads
+
+
+def _zstd() -> Tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]:
+    import zstandard
+
+    compressor = zstandard.ZstdCompressor()
+    decompressor = zstandard.ZstdDecompressor()
+    return compressor.compress, decompressor.decompress
+
+
+def _lz4() -> Tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]:
+    import lz4.frame
+
+    return lz4.frame.compress, lz4.frame.decompress
+
+
+FORMATS = {1: _json, 2: _orjson, 3: _msgpack}
+COMPRESSIONS = {1: _zstd, 2: _lz4}
+
+
+class Codec:
+    """Serializes cached values with a selectable format and optional compression.
+
+    `orjson`, `msgpack`, `zstandard` and `lz4` are optional dependencies and are
+    only imported when a format or compression that needs them is used.
+    Values are decoded according to their own header, so changing the format or
+    compression does not require flushing Redis.
+    """
+
+    def __init__(
+        self,
+        format: str = "json",
+        compression: Optional[str] = None,
+        compression_min_size: int = DEFAULT_COMPRESSION_MIN_SIZE,
+    ) -> None:
+        if format not in FORMAT_IDS:
+            raise ValueError(f"Unknown cache format {format!r}")
+        if compression not in COMPRESSION_IDS:
+            raise ValueError(f"Unknown cache compression {compression!r}")
+        self.format_id = FORMAT_IDS[format]
+        self.compression_id = COMPRESSION_IDS[compression]
+        self.compression_min_size = compression_min_size
+        self._formats: Dict[int, Tuple[Dumps, Loads]] = {}
+        self._compressions: Dict[int, Tuple[Callable, Callable]] = {}
+        # import the configured backends now so a missing package fails at startup
+        self.get_format(self.format_id)
+        if self.compression_id:
+            self.get_compression(self.compression_id)
+
+    def encode(self, value: Any) -> bytes:
+        dumps, _ = self.get_format(self.format_id)
+        return self.pack(self.format_id, dumps(value))
+
+    def pack(
+        self, format_id: int, payload: bytes, digest: Optional[bytes] = None
+    ) -> bytes:
+        """Prefix a serialized `payload` with its header, compressing it if large.
+
+        `digest` (see `Codec.digest`) is stored uncompressed after the header so
+        readers get it without hashing the payload again.
+        """
+        compression_id = 0
+        if self.compression_id and len(payload) >= self.compression_min_size:
+            compress, _ = self.get_compression(self.compression_id)
+            compressed = compress(payload)
+            if len(compressed) < len(payload):
+                compression_id, payload = self.compression_id, compressed
+        header = format_id | compression_id << COMPRESSION_SHIFT
+        if digest is None:
+            return bytes((header,)) + payload
+        return bytes((header | DIGEST_FLAG,)) + digest + payload
+
+    def unpack(self, data: bytes) -> Tuple[int, bytes, Optional[bytes]]:
+        """Return the format id, the decompressed payload and the digest of `data`."""
+        if not data or data[0] > MAX_HEADER:
+            return FORMAT_IDS["json"], data, None
+        header = data[0]
+        digest = None
+        if header & DIGEST_FLAG:
+            digest, payload = data[1:DIGEST_END], data[DIGEST_END:]
+        else:
+            payload = data[1:]
+        compression_id = (header & COMPRESSION_MASK) >> COMPRESSION_SHIFT
+        if compression_id:
+            _, decompress = self.get_compression(compression_id)
+            payload = decompress(payload)
+        return header & FORMAT_MASK, payload, digest
+
+    def decode(self, data: bytes) -> Any:
+        format_id, payload, _ = self.unpack(data)
+        _, loads = self.get_format(format_id)
+        return loads(payload)
+
+    @staticmethod
+    def digest(payload: bytes) -> bytes:
+        """Stable content hash of `payload`, the same in every process."""
+        return blake2b(payload, digest_size=DIGEST_SIZE).digest()
+
+    def get_format(self, format_id: int) -> Tuple[Dumps, Loads]:
+        if format_id not in self._formats:
+            self._formats[format_id] = FORMATS[format_id]()
+        return self._formats[format_id]
+
+    def get_compression(self, compression_id: int) -> Tuple[Callable, Callable]:
+        if compression_id not in self._compressions:
+            self._compressions[compression_id] = COMPRESSIONS[compression_id]()
+        return self._compressions[compression_id]
@@ -20,3 +20,7 @@ class RedisEvent(IntEnum):
     KEY_FOUND_IN_CACHE = 5
     FAILED_TO_CACHE_KEY = 6
     PATTERN_INVALIDATED = 7
+    NAMESPACE_INVALIDATED = 8
+    SUBSCRIBE_FAIL = 9
+    FAILED_TO_REFRESH_KEY = 10
+    TAGS_INVALIDATED = 11
@@ -1,13 +1,17 @@
 """cache.py"""
 from collections import OrderedDict
-from inspect import signature, Signature
-from typing import Any, Callable, Dict, List
+from hashlib import blake2b
+from inspect import signature, Parameter, Signature
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
-from fastapi import Request, Response
+from fastapi import BackgroundTasks, Request, Response
 
-from cache.types import ArgType, SigParameters
+from cache.types import ArgType
 
-ALWAYS_IGNORE_ARG_TYPES = [Response, Request]
+ALWAYS_IGNORE_ARG_TYPES = [Response, Request, BackgroundTasks]
+DIGEST_SIZE = 16
+ARG_SEPARATOR = "\x1f"
+VAR_KINDS = (Parameter.VAR_POSITIONAL, Parameter.VAR_KEYWORD)
 
 
 def get_cache_key_pattern(
@@ -23,7 +27,74 @@ def get_cache_key_pattern(
             Redis key pattern to retrieve all cached API keys.
     """
     prefix = f"{prefix}:" if prefix else ""
-    return f"{prefix}*.*(*)"
+    return f"{prefix}*"
+
+
+class KeyPlan:
+    """Everything needed to build the cache keys of one function, computed once.
+
+    Holds the signature, the ordered names (and defaults) of the arguments that
+    take part in the key and the qualified name of the function, so building a
+    key only reads the argument values and hashes them.
+    """
+
+    def __init__(
+        self, func: Callable, ignore_arg_types: Optional[List[ArgType]] = None
+    ) -> None:
+        ignored = set(ALWAYS_IGNORE_ARG_TYPES)
+        ignored.update(ignore_arg_types or [])
+        self.signature = signature(func)
+        self.name = f"{func.__module__}.{func.__qualname__}"
+        self.params: Tuple[Tuple[str, Any], ...] = tuple(
+            (name, param.default)
+            for name, param in self.signature.parameters.items()
+            if not is_ignored(param.annotation, ignored)
+        )
+        # without *args/**kwargs, keyword-only calls (how FastAPI calls endpoints)
+        # can skip `Signature.bind`
+        self.kwargs_only = not any(
+            param.kind in VAR_KINDS for param in self.signature.parameters.values()
+        )
+
+    def build(self, prefix: str, *args: List, **kwargs: Dict) -> str:
+        """Return `<prefix>:<function>:<digest of the argument values>`."""
+        if args or not self.kwargs_only:
+            kwargs = get_func_args(self.signature, *args, **kwargs)
+        values = []
+        for name, default in self.params:
+            value = kwargs.get(name, default)
+            if value is Parameter.empty:
+                # missing required argument, let `bind` raise the usual TypeError
+                kwargs = get_func_args(self.signature, *args, **kwargs)
+                value = kwargs[name]
+            values.append(f"{name}={value!r}")
+        digest = blake2b(
+            ARG_SEPARATOR.join(values).encode(), digest_size=DIGEST_SIZE
+        ).hexdigest()
+        prefix = f"{prefix}:" if prefix else ""
+        return f"{prefix}{self.name}:{digest}"
+
+
+def get_route_cache_key(
+    prefix: str,
+    path: str,
+    query: List[Tuple[str, str]],
+    headers: List[str],
+    claims: List[Any],
+) -> str:
+    """Return `<prefix>:route:<path>:<digest>` for a request served by `CacheRoute`.
+
+    The digest covers the sorted query parameters and the values of the headers
+    and token claims the response varies by.
+    """
+    values = [f"{name!r}={value!r}" for name, value in sorted(query)]
+    values.extend(f"h={value!r}" for value in headers)
+    values.extend(f"c={value!r}" for value in claims)
+    digest = blake2b(
+        ARG_SEPARATOR.join(values).encode(), digest_size=DIGEST_SIZE
+    ).hexdigest()
+    prefix = f"{prefix}:" if prefix else ""
+    return f"{prefix}route:{path}:{digest}"
 
 
 def get_cache_key(
@@ -35,10 +106,13 @@ def get_cache_key(
 ) -> str:
     """Generate a string that uniquely identifies the function and values of all arguments.
 
+    Builds a throwaway `KeyPlan`; callers that create keys for the same function
+    repeatedly should keep the plan and call `KeyPlan.build` instead.
+
     Args:
         prefix (`str`): Customizable namespace value that will prefix all cache keys.
         ignore_arg_types (`List[ArgType]`): Each argument to the API endpoint function is
-            used to compose the cache key by calling `str(arg)`. If there are any keys that
+            used to compose the cache key by calling `repr(arg)`. If there are any keys that
             should not be used in this way (i.e., because their value has no effect on the
             response, such as a `Request` or `Response` object) you can remove them from
             the cache key by including their type as a list item in ignore_key_types.
@@ -48,18 +122,7 @@ def get_cache_key(
         `str`: Unique identifier for `func`, `*args` and `**kwargs` that can be used as a
             Redis key to retrieve cached API response data.
     """
-
-    if not ignore_arg_types:
-        ignore_arg_types = []
-    ignore_arg_types.extend(ALWAYS_IGNORE_ARG_TYPES)
-    ignore_arg_types = list(set(ignore_arg_types))
-    prefix = f"{prefix}:" if prefix else ""
-
-    sig = signature(func)
-    sig_params = sig.parameters
-    func_args = get_func_args(sig, *args, **kwargs)
-    args_str = get_args_str(sig_params, func_args, ignore_arg_types)
-    return f"{prefix}{func.__module__}.{func.__name__}({args_str})"
+    return KeyPlan(func, ignore_arg_types).build(prefix, *args, **kwargs)
 
 
 def get_func_args(
@@ -71,14 +134,9 @@ def get_func_args(
     return func_args.arguments
 
 
-def get_args_str(
-    sig_params: SigParameters,
-    func_args: "OrderedDict[str, Any]",
-    ignore_arg_types: List[ArgType],
-) -> str:
-    """Return a string with the name and value of all args whose type is not included in `ignore_arg_types`"""
-    return ",".join(
-        f"{arg}={val}"
-        for arg, val in func_args.items()
-        if sig_params[arg].annotation not in ignore_arg_types
-    )
+def is_ignored(annotation: Any, ignored: set) -> bool:
+    try:
+        return annotation in ignored
+    except TypeError:  # pragma: no cover
+        # unhashable annotation, it can't be one of the ignored types
+        return False
@@ -0,0 +1,85 @@
+"""local.py"""
+
+from collections import OrderedDict
+from time import monotonic
+from typing import Callable, List, Optional, Tuple
+
+
+class LocalCache:
+    """Per-process LRU cache bounded by item count and memory, with per-entry TTL.
+
+    Values are the raw bytes stored in Redis, so a local hit skips the network
+    round trip but still goes through the same decoding as a Redis hit.
+    """
+
+    def __init__(
+        self,
+        max_items: int,
+        max_bytes: int,
+        max_ttl: float,
+        on_delete: Optional[Callable[[str], None]] = None,
+    ) -> None:
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.max_ttl = max_ttl
+        # called with the key of every entry that is deleted, expired or evicted
+        self.on_delete = on_delete
+        self.size_bytes = 0
+        # key -> (local expiry, expiry of the entry in redis, value)
+        self._entries: "OrderedDict[str, Tuple[float, float, bytes]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def keys(self) -> List[str]:
+        return list(self._entries)
+
+    def get(self, key: str) -> Optional[Tuple[int, bytes]]:
+        """Return `(ttl, value)` for `key`, or None if it is missing or expired.
+
+        `ttl` is the remaining lifetime of the entry in Redis, not in this cache.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, redis_expires_at, value = entry
+        now = monotonic()
+        if expires_at <= now:
+            self.delete(key)
+            return None
+        self._entries.move_to_end(key)
+        return int(redis_expires_at - now), value
+
+    def set(self, key: str, value: bytes, ttl: int) -> bool:
+        """Store `value`, False if it is too large (any old value is dropped)."""
+        size = len(key) + len(value)
+        self.delete(key)
+        if ttl <= 0 or size > self.max_bytes:
+            return False
+        now = monotonic()
+        self._entries[key] = (now + min(ttl, self.max_ttl), now + ttl, value)
+        self.size_bytes += size
+        while len(self._entries) > self.max_items or self.size_bytes > self.max_bytes:
+            old_key, (_, _, old_value) = self._entries.popitem(last=False)
+            self.size_bytes -= len(old_key) + len(old_value)
+            if self.on_delete:
+                self.on_delete(old_key)
+        return key in self._entries
+
+    def delete(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size_bytes -= len(key) + len(entry[2])
+            if self.on_delete:
+                self.on_delete(key)
+
+    def delete_prefix(self, prefix: str) -> None:
+        for key in [key for key in self._entries if key.startswith(prefix)]:
+            self.delete(key)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.size_bytes = 0
@@ -30,6 +30,6 @@ async def _connect(
 
 
 def _connect_fake() -> Tuple[RedisStatus, redis.Redis]:
-    from fakeredis import FakeRedis
+    from fakeredis.aioredis import FakeRedis
 
     return (RedisStatus.CONNECTED, FakeRedis())
@@ -0,0 +1,71 @@
+"""route.py"""
+from typing import Callable
+
+from fastapi import Request, Response
+from fastapi.dependencies.utils import get_flat_dependant
+from fastapi.routing import APIRoute
+
+from cache.cache import CACHE_OPTIONS_ATTR, ROUTE_CACHE_KEY, should_refresh_early
+from cache.client import Cache
+from cache.types import RouteCacheOptions
+
+
+class CacheRoute(APIRoute):
+    """Route that answers `@cache` hits before the endpoint's dependencies are resolved.
+
+    The key is built from the path, the query string and the headers and token
+    claims listed in `vary_headers`/`vary_claims` of the decorator, so a hit does
+    not open a database session or load the current user. Misses, stale values
+    and early refreshes go through the endpoint as usual, which stores the result
+    under the same key.
+
+    Use it with `APIRouter(route_class=CacheRoute)`.
+    """
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+        options: RouteCacheOptions = getattr(self.endpoint, CACHE_OPTIONS_ATTR, None)
+        if options is None:
+            return handler
+        if (
+            not options.vary_claims
+            and get_flat_dependant(self.dependant).security_requirements
+        ):
+            # the response depends on who asks, a hit must not skip authentication
+            return handler
+
+        async def cached_route_handler(request: Request) -> Response:
+            redis_cache = Cache()
+            if redis_cache.not_connected or redis_cache.request_is_not_cacheable(
+                request
+            ):
+                return await handler(request)
+            version = await redis_cache.get_namespace_version(options.namespace)
+            key = await redis_cache.get_route_cache_key(
+                request,
+                options.namespace,
+                version,
+                options.vary_headers,
+                options.vary_claims,
+            )
+            if key is None:
+                # no valid token, let the endpoint's dependencies reject the request
+                return await handler(request)
+            remaining_ttl, in_cache = await redis_cache.check_cache(key)
+            fresh_ttl = remaining_ttl - options.stale_ttl
+            if (
+                in_cache
+                and fresh_ttl > 0
+                and not should_refresh_early(
+                    fresh_ttl, options.delta, options.early_refresh
+                )
+            ):
+                redis_cache.stats.hits += 1
+                response = redis_cache.load_response(in_cache)
+                return redis_cache.make_response(
+                    response, request, True, fresh_ttl, bool(options.vary_claims)
+                )
+            request.scope[ROUTE_CACHE_KEY] = key
+            return await handler(request)
+
+        return cached_route_handler
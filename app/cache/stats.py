@@ -0,0 +1,20 @@
+"""stats.py"""
+
+from dataclasses import asdict, dataclass
+
+
+@dataclass
+class CacheStats:
+    """Per-worker counters describing how cached endpoints were served."""
+
+    hits: int = 0
+    misses: int = 0
+    # misses that awaited a computation already running in this worker
+    coalesced: int = 0
+    # misses that found another worker holding the recompute lock
+    lock_waited: int = 0
+    # lock waits that gave up and recomputed the value themselves
+    lock_timeouts: int = 0
+
+    def as_dict(self) -> dict:
+        return asdict(self)
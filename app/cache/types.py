@@ -1,5 +1,20 @@
+from dataclasses import dataclass
 from inspect import Parameter
-from typing import Mapping, Type
+from typing import Mapping, Tuple, Type
 
 ArgType = Type[object]
 SigParameters = Mapping[str, Parameter]
+
+
+@dataclass
+class RouteCacheOptions:
+    """Cache settings of an endpoint, read by `CacheRoute` before the endpoint runs."""
+
+    namespace: str | None
+    expire: int
+    stale_ttl: int
+    early_refresh: float
+    vary_headers: Tuple[str, ...]
+    vary_claims: Tuple[str, ...]
+    # duration of the last computation, used to schedule early refreshes
+    delta: float = 0.0
@@ -0,0 +1,246 @@
+import asyncio
+
+import pytest
+import fakeredis
+from fakeredis import aioredis
+from starlette.requests import Request
+
+from cache import cache
+from cache.backends import InMemoryBackend, LayeredBackend, RedisBackend
+from cache.cache import CACHE_OPTIONS_ATTR, CLAIMS_MAX_TTL, compute_once
+from cache.client import Cache
+from cache.local import LocalCache
+
+
+def memory_backend():
+    return InMemoryBackend(max_items=100, max_bytes=10**6)
+
+
+def redis_backend():
+    # a server per backend, FakeRedis instances share one by default
+    return RedisBackend(aioredis.FakeRedis(server=fakeredis.FakeServer()))
+
+
+def layered_backend():
+    return LayeredBackend(LocalCache(100, 10**6, 60), redis_backend(), "test|inv")
+
+
+backends = pytest.mark.parametrize(
+    "make_backend", [memory_backend, redis_backend, layered_backend]
+)
+
+
+def run(make_backend, check):
+    async def main():
+        backend = make_backend()
+        try:
+            await check(backend)
+        finally:
+            await backend.close()
+
+    asyncio.run(main())
+
+
+@backends
+def test_get_set(make_backend):
+    async def check(backend):
+        assert await backend.get_with_ttl("missing") == (-2, None)
+        assert await backend.set("key", b"value", 60)
+        ttl, value = await backend.get_with_ttl("key")
+        assert value == b"value"
+        assert 0 < ttl <= 60
+
+    run(make_backend, check)
+
+
+@backends
+def test_invalidate_tags(make_backend):
+    async def check(backend):
+        await backend.set("p:a", b"a", 60, ["tag:1", "tag:all"])
+        await backend.set("p:b", b"b", 60, ["tag:2", "tag:all"])
+        assert await backend.invalidate_tags(["tag:1"]) == ["p:a"]
+        assert (await backend.get_with_ttl("p:a"))[1] is None
+        assert (await backend.get_with_ttl("p:b"))[1] == b"b"
+        assert "p:b" in await backend.invalidate_tags(["tag:all"])
+        assert (await backend.get_with_ttl("p:b"))[1] is None
+        assert await backend.invalidate_tags(["tag:all"]) == []
+
+    run(make_backend, check)
+
+
+@backends
+def test_generations(make_backend):
+    async def check(backend):
+        assert await backend.get_generation("p|v:user") == 0
+        assert await backend.incr_generation("p|v:user", "p|user:") == 1
+        assert await backend.get_generation("p|v:user") == 1
+
+    run(make_backend, check)
+
+
+@backends
+def test_delete_pattern(make_backend):
+    async def check(backend):
+        await backend.set("p:a", b"a", 60)
+        await backend.set("q:b", b"b", 60)
+        await backend.delete_pattern("p:*")
+        assert (await backend.get_with_ttl("p:a"))[1] is None
+        assert (await backend.get_with_ttl("q:b"))[1] == b"b"
+
+    run(make_backend, check)
+
+
+@backends
+def test_locks(make_backend):
+    async def check(backend):
+        assert await backend.acquire_lock("key|lock", "one", 10)
+        assert not await backend.acquire_lock("key|lock", "two", 10)
+        await backend.release_lock("key|lock", "two")
+        assert not await backend.acquire_lock("key|lock", "two", 10)
+        await backend.release_lock("key|lock", "one")
+        assert await backend.acquire_lock("key|lock", "two", 10)
+
+    run(make_backend, check)
+
+
+def test_memory_backend_evicts_and_forgets_tags():
+    async def check(backend):
+        for i in range(3):
+            await backend.set(f"key:{i}", b"x", 60, ["tag"])
+        assert (await backend.get_with_ttl("key:0"))[1] is None
+        assert backend.tags["tag"] == {"key:1", "key:2"}
+
+    run(lambda: InMemoryBackend(max_items=2, max_bytes=10**6), check)
+
+
+def test_memory_backend_drops_old_value_when_new_one_is_too_large():
+    async def check(backend):
+        assert await backend.set("key", b"old", 60)
+        assert not await backend.set("key", b"x" * 100, 60)
+        assert (await backend.get_with_ttl("key"))[1] is None
+
+    run(lambda: InMemoryBackend(max_items=10, max_bytes=50), check)
+
+
+def test_cache_decorator_with_memory_backend():
+    calls = []
+
+    @cache(namespace="test", expire=60, as_response=False, tags=["item:{item_id}"])
+    async def get_item(item_id: int):
+        calls.append(item_id)
+        return {"id": item_id}
+
+    async def main():
+        redis_cache = Cache()
+        await redis_cache.init(
+            prefix="test", local_max_items=100, local_max_bytes=10**6, backend="memory"
+        )
+        try:
+            assert await get_item(item_id=1) == {"id": 1}
+            assert await get_item(item_id=1) == {"id": 1}
+            assert calls == [1]
+            await redis_cache.invalidate_tags(["item:1"])
+            assert await get_item(item_id=1) == {"id": 1}
+            assert calls == [1, 1]
+        finally:
+            await redis_cache.close()
+
+    asyncio.run(main())
+
+
+def test_waiters_take_over_when_the_computing_request_is_cancelled():
+    async def main():
+        redis_cache = Cache()
+        await redis_cache.init(
+            prefix="test", local_max_items=100, local_max_bytes=10**6, backend="memory"
+        )
+        started = asyncio.Event()
+
+        async def hang():
+            started.set()
+            await asyncio.sleep(60)
+
+        async def compute():
+            return {"id": 1}
+
+        def get(compute):
+            return compute_once(redis_cache, "key", 60, 5, 1, compute, lambda v: v)
+
+        try:
+            owner = asyncio.create_task(get(hang))
+            await started.wait()
+            waiter = asyncio.create_task(get(compute))
+            await asyncio.sleep(0)
+            owner.cancel()
+            assert await asyncio.wait_for(waiter, 1) == {"id": 1}
+            assert owner.cancelled()
+        finally:
+            await redis_cache.close()
+
+    asyncio.run(main())
+
+
+def test_invalidate_claims_changes_route_keys():
+    def request(sub):
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "path": "/users/",
+            "query_string": b"",
+            "headers": [],
+            "sub": sub,
+        }
+        return Request(scope)
+
+    async def main():
+        redis_cache = Cache()
+        await redis_cache.init(
+            prefix="test",
+            local_max_items=100,
+            local_max_bytes=10**6,
+            backend="memory",
+            claims_resolver=lambda request: {"sub": request.scope["sub"]},
+        )
+        try:
+
+            async def key(sub):
+                return await redis_cache.get_route_cache_key(
+                    request(sub), "user", 0, vary_claims=("sub",)
+                )
+
+            user_1, user_2 = await key("1"), await key("2")
+            await redis_cache.invalidate_claims({"sub": "1"})
+            assert await key("1") != user_1
+            assert await key("2") == user_2
+        finally:
+            await redis_cache.close()
+
+    asyncio.run(main())
+
+
+def test_claim_keyed_responses_are_private_and_short_lived():
+    @cache(namespace="test", expire=3600, vary_claims=["sub"])
+    async def get_me() -> dict:
+        return {"id": 1}
+
+    async def main():
+        redis_cache = Cache()
+        await redis_cache.init(
+            prefix="test", local_max_items=100, local_max_bytes=10**6, backend="memory"
+        )
+        try:
+            scope = {
+                "type": "http",
+                "method": "GET",
+                "path": "/me",
+                "query_string": b"",
+                "headers": [],
+            }
+            response = await get_me(cache_request=Request(scope))
+            cache_control = response.headers["Cache-Control"]
+            assert cache_control == f"private, max-age={CLAIMS_MAX_TTL}"
+        finally:
+            await redis_cache.close()
+
+    assert getattr(get_me, CACHE_OPTIONS_ATTR).expire == CLAIMS_MAX_TTL
+    asyncio.run(main())
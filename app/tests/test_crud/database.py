@@ -0,0 +1,41 @@
+import asyncio
+from typing import Awaitable, Callable
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from app.core.config import settings
+from app.db import base  # noqa: F401
+from app.db.base_class import Base
+
+TEST_DATABASE_ASYNC_URI = str(settings.SQLALCHEMY_TEST_DATABASE_URI).replace(
+    "postgresql://", "postgresql+asyncpg://", 1
+)
+
+
+def run_in_db(check: Callable[[AsyncSession], Awaitable]) -> None:
+    """
+    Run `check` with a session on fresh tables of the test database.
+    The queries under test are Postgres-only, the test is skipped if the
+    database is not reachable.
+    """
+
+    async def main() -> bool:
+        engine = create_async_engine(TEST_DATABASE_ASYNC_URI)
+        try:
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+        except OSError:
+            await engine.dispose()
+            return False
+        try:
+            async with AsyncSession(engine, expire_on_commit=False) as db:
+                await check(db)
+        finally:
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.drop_all)
+            await engine.dispose()
+        return True
+
+    if not asyncio.run(main()):
+        pytest.skip("the test database is not reachable")
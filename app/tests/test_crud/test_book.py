@@ -0,0 +1,283 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import func, select, update
+from sqlalchemy.dialects import postgresql
+
+from app import crud
+from app import exceptions as exc
+from app.api.api_v1.service import book as book_service
+from app.core.library_management import bill_taken_books
+from app.models.book import Book, Category, TakenBook
+from app.models.user import User
+from app.schemas.book import TakenBookStatus
+
+from .database import run_in_db
+
+NOW = datetime(2024, 1, 10, tzinfo=timezone.utc)
+
+
+async def add_library(db) -> None:
+    """A user and three books of one category, flushed in foreign key order."""
+    db.add(User(id=1, email="user1@example.com", hashed_password=""))
+    db.add(Category(id=1, name="novel", limit=3, rent_price=2, overdue_penalty=5))
+    await db.flush()
+    for i in (1, 2, 3):
+        db.add(Book(id=i, name=f"book {i}", category=1, amount=3))
+    await db.flush()
+
+
+def taken_book(book: int, status: int, user: int = 1, **kwargs) -> TakenBook:
+    values = dict(
+        taken_date=NOW, returning_date=NOW, valid_borrowed_days=7, bill=0
+    )
+    values.update(kwargs)
+    return TakenBook(book=book, user=user, status=status, **values)
+
+
+def test_find_user_tbs_counts_every_taken_book():
+    async def check(db):
+        await add_library(db)
+        db.add_all(
+            [
+                taken_book(1, TakenBookStatus().TAKEN),
+                taken_book(1, TakenBookStatus().SOLD),
+                taken_book(2, TakenBookStatus().RECEIVED),
+                taken_book(2, TakenBookStatus().SOLD),
+                taken_book(3, TakenBookStatus().RECEIVED),
+            ]
+        )
+        await db.commit()
+
+        books = await book_service.find_user_tbs(db, [1, 2, 3], borrowed_times=2)
+        assert [book.id for book in books] == [1, 2]
+
+    run_in_db(check)
+
+
+def test_get_statistics_groups_by_category_and_status():
+    async def check(db):
+        await add_library(db)
+        db.add_all(
+            [
+                taken_book(1, TakenBookStatus().SOLD, bill=10),
+                taken_book(2, TakenBookStatus().RECEIVED, bill=4),
+                taken_book(2, TakenBookStatus().RECEIVED, bill=6),
+                taken_book(3, TakenBookStatus().TAKEN, bill=None),
+                # its book is gone
+                taken_book(None, TakenBookStatus().SOLD, bill=3),
+            ]
+        )
+        await db.commit()
+
+        statistics = await crud.taken_book.get_statistics(db)
+        assert set(map(tuple, statistics)) == {
+            (1, TakenBookStatus().SOLD, 1, 10),
+            (1, TakenBookStatus().RECEIVED, 2, 10),
+            (1, TakenBookStatus().TAKEN, 1, 0),
+            (None, TakenBookStatus().SOLD, 1, 3),
+        }
+
+    run_in_db(check)
+
+
+def test_get_violations_ranks_users_by_overdue_books():
+    async def check(db):
+        await add_library(db)
+        for i in (2, 3):
+            db.add(User(id=i, email=f"user{i}@example.com", hashed_password=""))
+        await db.flush()
+        db.add_all(
+            [
+                taken_book(1, TakenBookStatus().OVERDUE, user=1),
+                taken_book(2, TakenBookStatus().OVERDUE_DELIVERED, user=1),
+                taken_book(1, TakenBookStatus().OVERDUE, user=2),
+                taken_book(2, TakenBookStatus().RECEIVED, user=2),
+                taken_book(3, TakenBookStatus().TAKEN, user=3),
+            ]
+        )
+        await db.commit()
+
+        most_first = [
+            (1, "user1@example.com", 2),
+            (2, "user2@example.com", 1),
+        ]
+        assert await crud.taken_book.get_violations(db) == most_first
+        least_first = await crud.taken_book.get_violations(db, most_first=False)
+        assert least_first == most_first[::-1]
+        page = await crud.taken_book.get_violations(db, limit=1, offset=1)
+        assert page == most_first[1:]
+
+    run_in_db(check)
+
+
+def test_change_stock_never_goes_below_zero():
+    async def check(db):
+        await add_library(db)
+        await db.commit()
+
+        assert (await crud.book.change_stock(db, 1, -3)).amount == 0
+        assert await crud.book.change_stock(db, 1, -1) is None
+        assert (await crud.book.change_stock(db, 1, 2)).amount == 2
+        assert await crud.book.change_stock(db, 99, 1) is None
+
+    run_in_db(check)
+
+
+def test_sell_book_commits_or_rolls_back_as_one_unit():
+    async def check(db):
+        await add_library(db)
+        await db.commit()
+        user, book = await db.get(User, 1), await db.get(Book, 1)
+
+        # the balance can't pay the price, the stock taken first is given back
+        with pytest.raises(exc.InternalServiceError):
+            await book_service.sell_book(db, user, book)
+        assert await db.scalar(select(Book.amount).filter(Book.id == 1)) == 3
+
+        await crud.user.change_balance(db, 1, 1)
+        await db.commit()
+        await db.refresh(user)
+        await db.refresh(book)
+        await book_service.sell_book(db, user, book)
+        assert await db.scalar(select(Book.amount).filter(Book.id == 1)) == 2
+        assert await db.scalar(select(User.balance).filter(User.id == 1)) == 0
+        sold = select(func.count()).filter(TakenBook.status == TakenBookStatus().SOLD)
+        assert await db.scalar(sold) == 1
+
+    run_in_db(check)
+
+
+def test_billing_charges_each_open_rental_once_a_day():
+    async def check(db):
+        await add_library(db)
+        due = datetime.now(timezone.utc) + timedelta(days=7)
+        db.add_all(
+            [
+                # sparse ids, paged by keyset two at a time
+                taken_book(1, TakenBookStatus().TAKEN, id=1, returning_date=due),
+                taken_book(2, TakenBookStatus().TAKEN, id=500),
+                taken_book(3, TakenBookStatus().OVERDUE, id=9000, bill=4),
+                taken_book(3, TakenBookStatus().RECEIVED, id=9001),
+            ]
+        )
+        await db.commit()
+
+        progress = await bill_taken_books(db, chunk_size=2)
+        assert (progress.chunks, progress.rentals, progress.overdue) == (2, 3, 2)
+        assert progress.charged == 6
+
+        # a second run the same day finds nothing left to bill
+        assert (await bill_taken_books(db, chunk_size=2)).rentals == 0
+        rows = await db.execute(
+            select(TakenBook.id, TakenBook.bill, TakenBook.status)
+            .order_by(TakenBook.id)
+        )
+        assert rows.all() == [
+            (1, 2, TakenBookStatus().TAKEN),
+            (500, 2, TakenBookStatus().OVERDUE),
+            (9000, 6, TakenBookStatus().OVERDUE),
+            (9001, 0, TakenBookStatus().RECEIVED),
+        ]
+        assert await db.scalar(select(User.balance).filter(User.id == 1)) == -6
+
+    run_in_db(check)
+
+
+def test_open_rentals_filter_matches_the_partial_index():
+    # the statuses are rendered inline, the predicate of the partial index
+    query = select(TakenBook.id).filter(crud.taken_book.is_open())
+    compiled = query.compile(
+        dialect=postgresql.dialect(), compile_kwargs={"render_postcompile": True}
+    )
+    sql = str(compiled)
+    assert "takenbooks.status IN (0, 2)" in sql
+
+
+def test_open_rentals_are_the_taken_and_overdue_books():
+    async def check(db):
+        await add_library(db)
+        db.add(User(id=2, email="user2@example.com", hashed_password=""))
+        db.add_all(
+            [
+                taken_book(1, TakenBookStatus().TAKEN, id=1),
+                taken_book(2, TakenBookStatus().OVERDUE, id=2),
+                taken_book(3, TakenBookStatus().RECEIVED, id=3),
+                taken_book(3, TakenBookStatus().SOLD, id=4),
+                taken_book(3, TakenBookStatus().TAKEN, id=5, user=2),
+            ]
+        )
+        await db.commit()
+
+        rentals = await crud.taken_book.get_open_rentals(db)
+        assert sorted(tb.id for tb in rentals) == [1, 2, 5]
+        rentals = await crud.taken_book.get_open_rentals(db, user_id=1)
+        assert sorted(tb.id for tb in rentals) == [1, 2]
+        assert await crud.taken_book.count_open_in_category(db, 1, 1) == 2
+        assert await crud.taken_book.count_open_in_category(db, 2, 1) == 1
+        assert await crud.taken_book.count_open_in_category(db, 1, 2) == 0
+
+    run_in_db(check)
+
+
+def test_rent_and_return_copy_keep_the_counters():
+    async def check(db):
+        await add_library(db)
+        await db.commit()
+
+        book = await crud.book.rent_copy(db, 1)
+        assert (book.amount, book.borrow_count, book.recent_borrow_count) == (2, 1, 1)
+        assert book.out_count == 1
+        book = await crud.book.return_copy(db, 1)
+        assert (book.amount, book.borrow_count, book.out_count) == (3, 1, 0)
+        # a return without a matching rental doesn't take out_count below zero
+        assert (await crud.book.return_copy(db, 1)).out_count == 0
+
+        await crud.book.change_stock(db, 2, -3)
+        assert await crud.book.rent_copy(db, 2) is None
+        assert await crud.book.rent_copy(db, 99) is None
+
+    run_in_db(check)
+
+
+def test_recompute_borrow_counters_fixes_the_drifted_books():
+    async def check(db):
+        await add_library(db)
+        old = NOW - timedelta(days=60)
+        db.add_all(
+            [
+                taken_book(1, TakenBookStatus().TAKEN),
+                taken_book(1, TakenBookStatus().RECEIVED, taken_date=old),
+                taken_book(1, TakenBookStatus().SOLD),
+                taken_book(2, TakenBookStatus().OVERDUE, taken_date=old),
+            ]
+        )
+        await db.flush()
+        # book 1 drifted, book 2 is right, book 3 still counts a rental aged out
+        await db.execute(
+            update(Book).filter(Book.id == 1).values(borrow_count=7, out_count=3)
+        )
+        await db.execute(
+            update(Book)
+            .filter(Book.id == 2)
+            .values(borrow_count=1, recent_borrow_count=0, out_count=1)
+        )
+        await db.execute(
+            update(Book).filter(Book.id == 3).values(recent_borrow_count=1)
+        )
+        await db.commit()
+
+        since = NOW - timedelta(days=30)
+        corrected = await crud.book.recompute_borrow_counters(
+            db, first_id=1, last_id=3, since=since
+        )
+        await db.commit()
+        assert corrected == 2
+        rows = await db.execute(
+            select(
+                Book.id, Book.borrow_count, Book.recent_borrow_count, Book.out_count
+            ).order_by(Book.id)
+        )
+        assert rows.all() == [(1, 2, 1, 1), (2, 1, 0, 1), (3, 0, 0, 0)]
+
+    run_in_db(check)
@@ -0,0 +1,30 @@
+from sqlalchemy import delete
+
+from app import crud, schemas
+from app.models.book import Category
+
+from .database import run_in_db
+
+
+def category(**fields) -> dict:
+    return dict(name="novel", limit=3, rent_price=2, overdue_penalty=5, **fields)
+
+
+def test_inserts_with_given_ids_move_the_id_sequence():
+    async def check(db):
+        await crud.category.upsert_many(db, objs_in=[category(id=5), category(id=7)])
+        created = await crud.category.create(db, obj_in=schemas.Category(**category()))
+        assert created.id == 8
+
+        columns = ["id", *schemas.Category.__fields__]
+        await crud.category.copy_many(db, objs_in=[category(id=20)], columns=columns)
+        created = await crud.category.create(db, obj_in=schemas.Category(**category()))
+        assert created.id == 21
+
+        # lower ids than the sequence's never move it backwards
+        await db.execute(delete(Category))
+        await crud.category.upsert_many(db, objs_in=[category(id=1)])
+        created = await crud.category.create(db, obj_in=schemas.Category(**category()))
+        assert created.id == 22
+
+    run_in_db(check)
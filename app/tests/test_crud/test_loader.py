@@ -0,0 +1,46 @@
+import asyncio
+from types import SimpleNamespace
+
+from app.crud.base import BatchLoader
+
+
+class FakeCRUD:
+    """Answers `get_by_ids` from memory and records every query."""
+
+    def __init__(self):
+        self.queries = []
+        self.busy = False
+
+    async def get_by_ids(self, db, ids):
+        # the session can't run two queries at once
+        assert not self.busy
+        self.busy = True
+        self.queries.append(list(ids))
+        await asyncio.sleep(0)
+        self.busy = False
+        return [SimpleNamespace(id=id) for id in ids if id != 404]
+
+
+def test_batches_loads_made_before_the_first_await():
+    async def main():
+        crud = FakeCRUD()
+        loader = BatchLoader(crud, db=None)
+        first, second = loader.load(1), loader.load(2)
+        assert (await second).id == 2
+        assert (await first).id == 1
+        rows = await loader.load_many([3, 404, 1])
+        assert [row and row.id for row in rows] == [3, None, 1]
+        assert crud.queries == [[1, 2], [3, 404]]
+
+    asyncio.run(main())
+
+
+def test_concurrent_awaits_share_one_query():
+    async def main():
+        crud = FakeCRUD()
+        loader = BatchLoader(crud, db=None)
+        rows = await asyncio.gather(*(loader.load(id) for id in [1, 2, 3]))
+        assert [row.id for row in rows] == [1, 2, 3]
+        assert crud.queries == [[1, 2, 3]]
+
+    asyncio.run(main())
@@ -0,0 +1,55 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from app import crud
+from app.crud.base import InvalidCursor
+from app.models.user import User
+
+
+@pytest.fixture()
+def db():
+    engine = create_engine("sqlite://")
+    User.__table__.create(engine)
+    with Session(engine) as session:
+        for i in range(1, 11):
+            session.add(User(id=i, email=f"user{i}@example.com", hashed_password=""))
+        session.commit()
+        yield session
+
+
+def ids(page):
+    return [user.id for user in page.items]
+
+
+def test_get_page_walks_forward_and_back(db):
+    first = crud.user.get_page(db, limit=4)
+    assert ids(first) == [10, 9, 8, 7]
+    assert first.prev_cursor is None
+
+    second = crud.user.get_page(db, limit=4, after=first.next_cursor)
+    assert ids(second) == [6, 5, 4, 3]
+
+    last = crud.user.get_page(db, limit=4, after=second.next_cursor)
+    assert ids(last) == [2, 1]
+    assert last.next_cursor is None
+
+    back = crud.user.get_page(db, limit=4, before=last.prev_cursor)
+    assert ids(back) == [6, 5, 4, 3]
+    back = crud.user.get_page(db, limit=4, before=back.prev_cursor)
+    assert ids(back) == [10, 9, 8, 7]
+    assert back.prev_cursor is None
+
+
+def test_get_page_by_created(db):
+    first = crud.user.get_page(db, limit=5, asc=True, order_by=("created", "id"))
+    second = crud.user.get_page(
+        db, limit=5, asc=True, order_by=("created", "id"), after=first.next_cursor
+    )
+    assert ids(first) + ids(second) == list(range(1, 11))
+
+
+@pytest.mark.parametrize("cursor", ["not-base64!", "e30", "WyJhIl0"])
+def test_get_page_rejects_invalid_cursor(db, cursor):
+    with pytest.raises(InvalidCursor):
+        crud.user.get_page(db, after=cursor)
@@ -0,0 +1,18 @@
+from app import crud
+from app.models.user import User
+
+from .database import run_in_db
+
+
+def test_change_balance_refuses_overdrafts():
+    async def check(db):
+        db.add(User(id=1, email="user1@example.com", hashed_password="", balance=5))
+        await db.commit()
+
+        assert (await crud.user.change_balance(db, 1, -5)).balance == 0
+        assert await crud.user.change_balance(db, 1, -1) is None
+        debited = await crud.user.change_balance(db, 1, -1, allow_negative=True)
+        assert debited.balance == -1
+        assert (await crud.user.change_balance(db, 1, 3)).balance == 2
+
+    run_in_db(check)
@@ -0,0 +1,34 @@
+from app.log.log import RequestLogPolicy
+
+
+def test_route_filters():
+    policy = RequestLogPolicy(include=["/api/v1/books/*"], exclude=["*/get-all"])
+    assert policy.should_log("/api/v1/books/sell", 200)
+    assert not policy.should_log("/api/v1/books/get-all", 200)
+    assert not policy.should_log("/api/v1/books/get-all", 500)
+    assert not policy.should_log("/api/v1/users/", 200)
+
+
+def test_samples_successes_but_keeps_errors():
+    policy = RequestLogPolicy(sample_rate=0)
+    assert not policy.should_log("/api/v1/books/sell", 200)
+    assert policy.should_log("/api/v1/books/sell", 400)
+    assert policy.should_log("/api/v1/books/sell", 500)
+
+
+def test_truncates_bodies():
+    policy = RequestLogPolicy(max_body_bytes=4)
+    assert policy.capture_body(b"abcd") == "abcd"
+    assert policy.capture_body(b"abcdefg") == "abcd...[truncated 3 bytes]"
+    assert RequestLogPolicy(max_body_bytes=0).capture_body(b"ab") == (
+        "...[truncated 2 bytes]"
+    )
+
+
+def test_redacts_authorization():
+    policy = RequestLogPolicy()
+    assert policy.capture_authorization("Bearer token") == "Bearer [redacted]"
+    assert policy.capture_authorization("token") == "[redacted]"
+    assert policy.capture_authorization(None) is None
+    kept = RequestLogPolicy(redact_authorization=False)
+    assert kept.capture_authorization("Bearer token") == "Bearer token"
@@ -0,0 +1,58 @@
+import asyncio
+
+import httpx
+from fastapi import APIRouter, FastAPI
+
+from app.log import log
+from app.log.log import LogRoute
+
+from .test_writer import MemoryWriter
+
+router = APIRouter(route_class=LogRoute)
+
+
+@router.get("/items/{name}")
+async def read_item(name: str) -> dict:
+    return {"name": name}
+
+
+app = FastAPI()
+app.include_router(router)
+
+
+def test_requests_are_queued_and_flushed(monkeypatch):
+    writer = MemoryWriter(batch_size=10, flush_interval=60, max_size=100)
+    monkeypatch.setattr(log, "request_log_writer", writer)
+
+    async def main():
+        await writer.start()
+        async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+            response = await client.get("/items/book")
+        assert response.json() == {"name": "book"}
+        await writer.close()
+
+    asyncio.run(main())
+    [[request_log]] = writer.batches
+    assert request_log["service_name"] == "/items/book"
+    assert request_log["method"] == "GET"
+    assert request_log["response"] == '{"name":"book"}'
+
+
+def test_values_are_cut_to_the_column_lengths(monkeypatch):
+    writer = MemoryWriter(batch_size=10, flush_interval=60, max_size=100)
+    monkeypatch.setattr(log, "request_log_writer", writer)
+    name = "b" * 100
+
+    async def main():
+        await writer.start()
+        async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+            await client.get(f"/items/{name}")
+        await writer.close()
+
+    asyncio.run(main())
+    [[request_log]] = writer.batches
+    assert request_log["service_name"] == f"/items/{name}"[:50]
+    assert log.fit_request_log({"method": "PROPFIND-LONG", "ip": None}) == {
+        "method": "PROPFIND-L",
+        "ip": None,
+    }
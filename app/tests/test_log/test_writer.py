@@ -0,0 +1,74 @@
+import asyncio
+
+from app.log.log import RequestLogWriter
+
+
+class MemoryWriter(RequestLogWriter):
+    """Keeps the batches instead of writing them to the database."""
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.batches = []
+
+    async def _write(self, batch) -> None:
+        self.batches.append(batch)
+        self.written += len(batch)
+
+
+def log(i: int) -> dict:
+    return {"service_name": f"/items/{i}", "method": "GET"}
+
+
+def test_writes_full_batches_right_away():
+    async def main():
+        writer = MemoryWriter(batch_size=3, flush_interval=60, max_size=100)
+        await writer.start()
+        for i in range(7):
+            await writer.put(log(i))
+        await asyncio.sleep(0.01)
+        assert [len(batch) for batch in writer.batches] == [3, 3]
+        await writer.close()
+        assert [len(batch) for batch in writer.batches] == [3, 3, 1]
+        assert writer.written == 7
+
+    asyncio.run(main())
+
+
+def test_flushes_partial_batch_after_interval():
+    async def main():
+        writer = MemoryWriter(batch_size=100, flush_interval=0.05, max_size=100)
+        await writer.start()
+        await writer.put(log(1))
+        await asyncio.sleep(0.15)
+        assert writer.batches == [[log(1)]]
+        await writer.close()
+
+    asyncio.run(main())
+
+
+def test_drops_logs_when_full():
+    async def main():
+        writer = MemoryWriter(batch_size=10, flush_interval=60, max_size=2)
+        await writer.start()
+        for i in range(5):
+            await writer.put(log(i))
+        assert writer.dropped == 3
+        await writer.close()
+        assert writer.batches == [[log(0), log(1)]]
+
+    asyncio.run(main())
+
+
+def test_blocks_when_full():
+    async def main():
+        writer = MemoryWriter(
+            batch_size=2, flush_interval=60, max_size=2, overflow="block"
+        )
+        await writer.start()
+        for i in range(6):
+            await writer.put(log(i))
+        await writer.close()
+        assert writer.dropped == 0
+        assert writer.written == 6
+
+    asyncio.run(main())
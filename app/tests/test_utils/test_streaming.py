@@ -0,0 +1,48 @@
+import json
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.utils import APIStreamingResponse
+
+app = FastAPI()
+
+
+async def batches():
+    yield [{"id": 1}, {"id": 2}]
+    yield []
+    yield [{"id": 3}]
+
+
+@app.get("/items")
+async def get_items(ndjson: bool = False):
+    return APIStreamingResponse(batches(), ndjson=ndjson)
+
+
+client = TestClient(app)
+
+
+def test_streams_api_response():
+    response = client.get("/items")
+    assert response.headers["content-type"] == "application/json"
+    body = response.json()
+    assert body["header"]["messageCode"] == 0
+    assert body["content"] == [{"id": 1}, {"id": 2}, {"id": 3}]
+
+
+def test_streams_ndjson():
+    response = client.get("/items", params={"ndjson": True})
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = response.text.splitlines()
+    assert [json.loads(line) for line in lines] == [{"id": 1}, {"id": 2}, {"id": 3}]
+
+
+def test_streams_empty_list():
+    async def no_batches():
+        return
+        yield
+
+    empty_app = FastAPI()
+    empty_app.get("/items")(lambda: APIStreamingResponse(no_batches()))
+    response = TestClient(empty_app).get("/items")
+    assert response.json()["content"] == []